@@ -0,0 +1,215 @@
+# Benchmark suite for the backtesting engine, over deterministic synthetic data (see synthetic.py). Run from the repo root:
+#
+#   python -m benchmarks.bench                                   run every case, results go to benchmarks/results.json
+#   python -m benchmarks.bench --baseline benchmarks/baseline.json   and compare against a saved run, exit 1 on regressions
+#   python -m benchmarks.bench --quick --filter order_book       smaller sizes, only the cases whose name contains the filter
+#
+# A saved results file is a baseline: copy results.json (or pass --output) to keep one. A case regresses when its best time is
+# more than --threshold (default 10%) slower than the baseline's.
+
+from typing import Callable, Dict, List, Optional
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import candle_dicts, candle_ranges, resting_orders, synthetic_candles, write_candle_json
+from src.account import Account
+from src.candle_manager import analyze_patterns, ingest_candles, pattern_statistics, preprocess_candles
+from src.order_manager import OrderManager
+from src.simulation import run_simulation
+from src.strategy import load_strategy_class
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_STRATEGY = os.path.join(REPO_ROOT, 'strategies', 'test_strategy.py')
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, 'benchmarks', 'results.json')
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_REPEAT = 5
+
+'''
+One benchmark. setup() builds the state a run needs and is called before every repeat, outside the timing, so runs that
+consume their state (like removing every order) start fresh each time. run(state) is the timed part and does `ops` units of work.
+'''
+class Case:
+    def __init__(self, name: str, run: Callable, setup: Optional[Callable] = None, ops: int = 1, unit: str = 'op'):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda: None)
+        self.ops = ops
+        self.unit = unit
+
+    def measure(self, repeat: int) -> Dict:
+        times = []
+        for _ in range(repeat):
+            state = self.setup()
+            started = time.perf_counter()
+            self.run(state)
+            times.append(time.perf_counter() - started)
+
+        best = min(times)
+        return {
+            'seconds': best,
+            'median_seconds': statistics.median(times),
+            'repeat': repeat,
+            'ops': self.ops,
+            'unit': self.unit,
+            'ops_per_second': self.ops / best if best > 0 else 0.0
+        }
+
+    def __repr__(self) -> str:
+        return f"Case(name={self.name}, ops={self.ops} {self.unit})"
+
+def order_book_cases(sizes) -> List[Case]:
+    cases = []
+    for n in sizes:
+        orders = resting_orders(n)
+        ranges = candle_ranges(10_000)
+
+        def filled_book(orders=orders):
+            order_manager = OrderManager("BENCH")
+            for order in orders:
+                order_manager.add_order(order)
+            return order_manager
+
+        def insert(order_manager, orders=orders):
+            for order in orders:
+                order_manager.add_order(order)
+
+        def remove(order_manager, orders=orders):
+            for order in orders:
+                order_manager.remove_order(order)
+
+        def trigger(order_manager, ranges=ranges):
+            for low, high in ranges:
+                order_manager.get_triggered_orders(low, high)
+
+        def cross(order_manager, ranges=ranges):
+            for low, high in ranges:
+                order_manager.get_orders_crossed_by(low, high)
+                order_manager.get_orders_crossed_by(high, low)
+
+        label = f"{n // 1000}k"
+        cases += [
+            Case(f"order_book_insert_{label}", insert, lambda: OrderManager("BENCH"), n, 'order'),
+            Case(f"order_book_remove_{label}", remove, filled_book, n, 'order'),
+            Case(f"order_book_trigger_{label}", trigger, filled_book, len(ranges), 'candle'),
+            Case(f"order_book_cross_{label}", cross, filled_book, 2 * len(ranges), 'path segment'),
+        ]
+    return cases
+
+def simulation_cases(n_candles: int) -> List[Case]:
+    candles = synthetic_candles(n_candles)
+    strategy_class = load_strategy_class(TEST_STRATEGY)
+
+    def new_strategy():
+        return strategy_class(Account("SOLPERP", 1000, 0.1, 0.05))
+
+    return [Case("simulation_loop_test_strategy", lambda strategy: run_simulation(strategy, candles), new_strategy, n_candles, 'candle')]
+
+def ingestion_cases(n_candles: int, work_dir: str) -> List[Case]:
+    candles = synthetic_candles(n_candles)
+    dicts = candle_dicts(candles)
+    json_path = os.path.join(work_dir, 'candles.json')
+    write_candle_json(json_path, candles)
+
+    return [
+        Case("preprocess_candles", lambda _: preprocess_candles(dicts), None, n_candles, 'candle'),
+        Case("ingest_candles_json", lambda _: ingest_candles(json_path, os.path.join(work_dir, 'candles.npy')), None, n_candles, 'candle'),
+    ]
+
+def pattern_cases(n_candles: int) -> List[Case]:
+    candles = synthetic_candles(n_candles)
+
+    def analyze(_):
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze_patterns(candles, 5)
+
+    return [
+        Case("analyze_patterns_5", analyze, None, n_candles, 'candle'),
+        Case("pattern_statistics_ternary_8", lambda _: pattern_statistics(candles, 8, ternary=True, doji_threshold=0.0005), None, n_candles, 'candle'),
+    ]
+
+def build_cases(work_dir: str, quick: bool = False) -> List[Case]:
+    if quick:
+        return (order_book_cases((10_000,)) + simulation_cases(10_000) + ingestion_cases(20_000, work_dir) + pattern_cases(100_000))
+    return (order_book_cases((10_000, 100_000)) + simulation_cases(50_000) + ingestion_cases(200_000, work_dir) + pattern_cases(1_000_000))
+
+def run_suite(name_filter: Optional[str] = None, repeat: int = DEFAULT_REPEAT, quick: bool = False) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix='futureproof_bench_')
+    try:
+        results = {}
+        for case in build_cases(work_dir, quick):
+            if name_filter and name_filter not in case.name:
+                continue
+            results[case.name] = case.measure(repeat)
+            result = results[case.name]
+            print(f"{case.name:<36} {result['seconds'] * 1000:>10.2f} ms  {result['ops_per_second']:>14,.0f} {case.unit}/s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'quick': quick,
+            'repeat': repeat
+        },
+        'results': results
+    }
+
+def compare(results: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    # Prints how each case moved against the baseline and returns the names of the cases slower by more than threshold
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<36} {'new':>10}")
+            continue
+
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] > 0 else float('inf')
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<36} {ratio:>9.2f}x  {'REGRESSION' if regressed else 'ok'}")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the backtesting engine on synthetic data")
+    parser.add_argument('--filter', help="only run cases whose name contains this")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="runs per case, the best one counts")
+    parser.add_argument('--quick', action='store_true', help="smaller inputs, for a fast check")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="where to write the results json")
+    parser.add_argument('--baseline', help="results json to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown against the baseline, 0.1 is 10%%")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.filter, args.repeat, args.quick)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('quick') != results['meta']['quick']:
+            print("Warning: the baseline was run with different input sizes (--quick)")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
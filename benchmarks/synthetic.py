@@ -0,0 +1,56 @@
+from typing import List, Tuple
+import json
+import numpy as np
+from src.candle_manager import CANDLE_DTYPE
+from src.order import BaseOrder, OrderDirection
+
+# Fixed seed and start so every run of the suite sees exactly the same data
+SEED = 0
+START_MS = 1719792000000 # 2024-07-01
+INTERVAL_MS = 60 * 1000
+
+def synthetic_candles(n: int, seed: int = SEED, start_price: float = 140.0, volatility: float = 0.001) -> np.ndarray:
+    # 1m candles from a geometric random walk, each candle opens at the previous close
+    rng = np.random.default_rng(seed)
+    closes = start_price * np.exp(np.cumsum(rng.normal(0, volatility, n)))
+    opens = np.concatenate(([start_price], closes[:-1]))
+
+    candles = np.empty(n, dtype=CANDLE_DTYPE)
+    candles['start'] = START_MS + np.arange(n, dtype=np.int64) * INTERVAL_MS
+    candles['open'] = opens
+    candles['high'] = np.maximum(opens, closes) * (1 + rng.uniform(0, volatility, n))
+    candles['low'] = np.minimum(opens, closes) * (1 - rng.uniform(0, volatility, n))
+    candles['close'] = closes
+    return candles
+
+def candle_dicts(candles: np.ndarray) -> List[dict]:
+    # The exchange json layout preprocess_candles reads: every field a string
+    return [
+        {'start': str(start), 'open': repr(open_price), 'high': repr(high), 'low': repr(low), 'close': repr(close)}
+        for start, open_price, high, low, close in candles.tolist()
+    ]
+
+def write_candle_json(path: str, candles: np.ndarray):
+    with open(path, 'w') as f:
+        json.dump({'candles': candle_dicts(candles)}, f)
+
+def resting_orders(n: int, mid_price: float = 140.0, spread: float = 0.1, seed: int = SEED) -> List[BaseOrder]:
+    # n limit orders, longs below mid_price and shorts above it, within +/- spread of it, in random order
+    rng = np.random.default_rng(seed)
+    offsets = rng.uniform(0.0001, spread, n)
+    directions = rng.integers(0, 2, n)
+
+    orders = []
+    for offset, is_long in zip(offsets.tolist(), directions.tolist()):
+        if is_long:
+            orders.append(BaseOrder(OrderDirection.LONG, size=1, price=mid_price * (1 - offset)))
+        else:
+            orders.append(BaseOrder(OrderDirection.SHORT, size=1, price=mid_price * (1 + offset)))
+    return orders
+
+def candle_ranges(n: int, mid_price: float = 140.0, width: float = 0.002, seed: int = SEED) -> List[Tuple[float, float]]:
+    # (low, high) of n candles wandering around mid_price, most touch a few of the resting orders
+    rng = np.random.default_rng(seed + 1)
+    centers = mid_price * (1 + rng.normal(0, width, n))
+    half_widths = centers * rng.uniform(0, width, n)
+    return list(zip((centers - half_widths).tolist(), (centers + half_widths).tolist()))
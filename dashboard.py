@@ -1,21 +1,71 @@
 from datetime import datetime, timezone
-import importlib
-import inspect
-import json
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for
 from src.account import Account
-from src.candle_manager import preprocess_candles
+from src.candle_manager import load_candles, load_day_index, load_resampled_candles, get_candle_range, parse_timeframe, TIMEFRAME_UNITS_MS
+from src.downsample import bucket_first_indices, lttb_indices
+from src.job_queue import JobQueue, DONE, FINISHED_STATES
+from src.metrics import MINUTES_PER_YEAR
+from src.order import OrderDirection
+from src.profiler import Profiler
+from src.result_cache import ResultCache, backtest_key, file_fingerprint
 import src.simulation
 import src.strategy
+import json
 import os
+import time
 
+import numpy as np
+import plotly
 import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
 from plotly.subplots import make_subplots
-import plotly.offline as pyo
 
 app = Flask(__name__)
 
 STRATEGIES_FOLDER = 'strategies'
+CANDLES_FILE = "data/candles/SOLUSDT_1m.json"
+RESULTS_FOLDER = 'data/results'
+RESULTS_MAX_BYTES = 512 * 1024 * 1024
+ACCOUNT_SETTINGS = ("SOLPERP", 1000, 0.1, 0.05)
+
+JOB_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+PROGRESS_EVERY = 5000 # candles between progress reports
+PROGRESS_INTERVAL = 0.5 # seconds between server-sent events
+PROFILE_SAMPLE_EVERY = 8 # profiled runs time one call in this many per phase
+JOB_HISTORY = 20 # finished jobs (and their full resolution series) kept for zooming
+
+PLOT_POINTS = 2000 # points per curve sent to the browser
+MAX_PLOT_POINTS = 20000
+MARKER_BUCKETS = 500 # at most one long and one short marker per bucket
+
+# Runs after the plot is created, '{plot_id}' is filled in by plotly
+ZOOM_SCRIPT = """
+const plot = document.getElementById('{plot_id}');
+let zoomRequest = 0;
+plot.on('plotly_relayout', (event) => {
+    let query = '';
+    if (event['xaxis.range[0]'] !== undefined) {
+        const toMs = (date) => Date.parse(String(date).replace(' ', 'T') + 'Z');
+        query = `?start=${Math.floor(toMs(event['xaxis.range[0]']))}&end=${Math.ceil(toMs(event['xaxis.range[1]']))}`;
+    } else if (!event['xaxis.autorange']) {
+        return;
+    }
+    const request = ++zoomRequest;
+    fetch('{series_url}' + query).then((response) => response.json()).then((traces) => {
+        if (request !== zoomRequest) return;
+        const names = ['prices', 'equity', 'longs', 'shorts'];
+        Plotly.restyle(plot, {x: names.map((name) => traces[name].x), y: names.map((name) => traces[name].y)}, [0, 1, 2, 3]);
+    });
+});
+"""
+
+result_cache = ResultCache(RESULTS_FOLDER, RESULTS_MAX_BYTES)
+jobs = JobQueue(JOB_WORKERS, JOB_HISTORY)
+# source hash -> strategy class, so a strategy is only re-imported when its file changes
+strategy_classes = {}
+# (candles file, timeframe ms, file mtime) -> (candles, day index)
+candle_stores = {}
 
 @app.route('/')
 def index():
@@ -33,6 +83,8 @@ def run_script():
     end_time = "00:00"
     
     strategy_file = request.form['strategy_file']
+    timeframe = request.form.get('timeframe', '1m')
+    profile = 'profile' in request.form
     
     # Combine date and time and convert to UTC timestamp in milliseconds
     start_datetime = datetime.strptime(f"{start_date} {start_time}", "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
@@ -41,105 +93,200 @@ def run_script():
     start_timestamp = int(start_datetime.timestamp() * 1000)
     end_timestamp = int(end_datetime.timestamp() * 1000)
     
-    # Here you can call your script or function with these integers
-    asset_price, portfolio, metrics = run_simulation(start_timestamp, end_timestamp, strategy_file)
+    # Cached results finish right away, anything else runs in the job queue while the page follows its progress
+    key = backtest_cache_key(start_timestamp, end_timestamp, strategy_file, timeframe, profile)
+    cached = result_cache.get(key)
+    if cached is not None:
+        job_id = jobs.add_result(cached)
+    else:
+        job_id = jobs.submit(run_simulation, start_timestamp, end_timestamp, strategy_file, timeframe, profile,
+                             on_done=lambda result: result_cache.put(key, *result))
     
-    # Generate the plot
-    plot_div = plot_floats_over_time(asset_price, portfolio)
-    
-    return render_template('index.html', plot_div=plot_div, metrics=metrics, strategy_files=os.listdir(STRATEGIES_FOLDER))
+    return redirect(url_for('job_page', job_id=job_id))
 
-def run_simulation(start_ts, end_ts, strategy_file):
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        return redirect(url_for('index'))
+    
+    strategy_files = [f for f in os.listdir(STRATEGIES_FOLDER) if f.endswith('.py')]
+    if status['state'] != DONE:
+        return render_template('index.html', job=status, strategy_files=strategy_files)
+    
+    series, metrics = jobs.result(job_id)
+    
+    # Generate the plot, zooming fetches finer detail from job_series
+    plot_div = plot_floats_over_time(series, series_url=url_for('job_series', job_id=job_id))
     
-    filename = "data/candles/SOLUSDT_1m.json"
-    strategy_class = get_strategy_class(strategy_file)
+    return render_template('index.html', plot_div=plot_div, metrics=metrics, strategy_files=strategy_files)
 
-    with open(filename, 'r') as f:
-        raw_candles = json.load(f)["candles"]
-        candles = preprocess_candles(raw_candles)
+@app.route('/jobs/<job_id>/series')
+def job_series(job_id):
+    # Downsampled traces between the start and end timestamps (ms) for the zoomed in part of the plot
+    result = jobs.result(job_id)
+    if result is None:
+        return jsonify({'error': 'unknown job'}), 404
     
-    # binary search refactor
-    start_index = next(i for i, candle in enumerate(candles) if candle['start'] >= start_ts)
-    end_index = next(i for i, candle in enumerate(candles) if candle['start'] >= end_ts)
+    start = request.args.get('start', type=int)
+    end = request.args.get('end', type=int)
+    points = max(3, min(request.args.get('points', PLOT_POINTS, type=int), MAX_PLOT_POINTS)) # LTTB keeps at least the first and last point and one more
+    return jsonify(downsample_series(result[0], start, end, points))
+
+@app.route('/plotly.min.js')
+def plotly_js():
+    # Served once and cached by the browser instead of inlined in every page
+    response = Response(get_plotlyjs(), mimetype='application/javascript')
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    return response
+
+@app.context_processor
+def plotly_js_url():
+    # The version in the url busts the browser cache when plotly is upgraded
+    return {'plotly_js_url': url_for('plotly_js', v=plotly.__version__)}
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    # Server-sent events with the job's status until it finishes
+    def stream():
+        while True:
+            status = jobs.status(job_id)
+            yield f"data: {json.dumps(status)}\n\n"
+            if status is None or status['state'] in FINISHED_STATES:
+                break
+            time.sleep(PROGRESS_INTERVAL)
     
-    candles = candles[start_index: end_index]
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    return jsonify({'cancelled': jobs.cancel(job_id)})
+
+def backtest_cache_key(start_ts, end_ts, strategy_file, timeframe='1m', profile=False):
+    strategy_class, fingerprint = get_strategy_class(strategy_file)
+    candles = load_candle_range(start_ts, end_ts, timeframe)
+    strategy = strategy_class(Account(*ACCOUNT_SETTINGS))
+    return backtest_key(fingerprint, strategy.hp, candles, timeframe=timeframe, account=ACCOUNT_SETTINGS, profile=profile)
 
-    account = Account("SOLPERP", 1000, 0.1, 0.05)
+def run_simulation(start_ts, end_ts, strategy_file, timeframe='1m', profile=False, report=None):
+    # report(candles done, total candles, equity=...) is called every PROGRESS_EVERY candles, returning True stops the run.
+    # profile adds the time spent in each phase of the run to the metrics.
+    strategy_class, _ = get_strategy_class(strategy_file)
+    candles = load_candle_range(start_ts, end_ts, timeframe)
+
+    account = Account(*ACCOUNT_SETTINGS)
     strategy = strategy_class(account)
     
-    _, portfolio, time_series = src.simulation.run_simulation(strategy, candles)
+    on_checkpoint = None
+    if report is not None:
+        on_checkpoint = lambda i, strategy: report(i + 1, len(candles), equity=float(strategy.account.collateral_manager.total_collateral))
+    
+    profiler = Profiler(PROFILE_SAMPLE_EVERY) if profile else None
+    _, portfolio, time_series = src.simulation.run_simulation(strategy, candles, on_checkpoint=on_checkpoint, checkpoint_every=PROGRESS_EVERY, profiler=profiler)
+    
+    series = {
+        'timestamps': np.array(candles['start'][:len(time_series)]),
+        'prices': np.array(time_series),
+        'equity': np.array(portfolio),
+        'fills': strategy.metrics.order_history.to_numpy()
+    }
     
     metrics = {
-        'end_balance': round(account.collateral_manager.total_collateral, 3),
-        'total_trades': strategy.metrics.total_trades,
-        'total_longs': strategy.metrics.total_longs,
-        'total_shorts': strategy.metrics.total_shorts
+        'end_balance': round(float(account.collateral_manager.total_collateral), 3),
+        'total_trades': int(strategy.metrics.total_trades),
+        'total_longs': int(strategy.metrics.total_longs),
+        'total_shorts': int(strategy.metrics.total_shorts),
+        'performance': strategy.metrics.performance(MINUTES_PER_YEAR * TIMEFRAME_UNITS_MS['m'] / parse_timeframe(timeframe))
     }
+    if profiler is not None:
+        metrics['profile'] = profiler.report()
     
-    return time_series, portfolio, metrics
+    return series, metrics
+
+def load_candle_range(start_ts, end_ts, timeframe='1m'):
+    # Loaded stores are kept per process (and per job worker), they are memory-mapped so this costs no copies
+    timeframe_ms = parse_timeframe(timeframe)
+    store_key = (CANDLES_FILE, timeframe_ms, os.path.getmtime(CANDLES_FILE))
+    store = candle_stores.get(store_key)
+    if store is None:
+        # Higher timeframes come from the store's resampled pyramid
+        if timeframe_ms == TIMEFRAME_UNITS_MS['m']:
+            store = load_candles(CANDLES_FILE), load_day_index(CANDLES_FILE)
+        else:
+            store = load_resampled_candles(CANDLES_FILE, timeframe)[0], None
+        candle_stores[store_key] = store
+    
+    candles, day_index = store
+    return get_candle_range(candles, start_ts, end_ts, day_index)
 
 def get_strategy_class(strategy_file):
-    # Dynamically import and the selected strategy
-    strategy_module_name = strategy_file.replace('.py', '')
-    strategy_module_path = os.path.join(STRATEGIES_FOLDER, strategy_file)
-    spec = importlib.util.spec_from_file_location(strategy_module_name, strategy_module_path)
-    strategy_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(strategy_module)
-    
-    # Find the only class in the strategy module
-    strategy_class = None
-    for _, obj in inspect.getmembers(strategy_module, inspect.isclass):
-        if issubclass(obj, src.strategy.Strategy) and obj is not src.strategy.Strategy:
-            strategy_class = obj
-            break
-    
-    if not strategy_class:
-        raise ValueError(f"No subclass of Strategy found in the strategy file {strategy_file}")
-    
-    return strategy_class
-    
-def plot_floats_over_time(asset_price, portfolio, title='Equity Curve', xlabel='Timeline', ylabel1='Asset Price', ylabel2='Portfolio'):
+    # Dynamically import the selected strategy, returns the class and the hash of its source
+    path = os.path.join(STRATEGIES_FOLDER, strategy_file)
+    fingerprint = file_fingerprint(path)
+    if fingerprint not in strategy_classes:
+        strategy_classes[fingerprint] = src.strategy.load_strategy_class(path)
+    return strategy_classes[fingerprint], fingerprint
+    
+def downsample_series(series, start=None, end=None, points=PLOT_POINTS):
+    # Shape preserving downsample (LTTB) of the curves between the start and end timestamps, trade markers are
+    # thinned to the first long and first short per bucket. Returns plain lists, ready for json.
+    timestamps = series['timestamps']
+    lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+    hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='right'))
+    # One point either side so the lines run to the edges of the zoomed range
+    lo, hi = max(lo - 1, 0), min(hi + 1, len(timestamps))
+    x = timestamps[lo:hi]
+    
+    traces = {}
+    for name in ('prices', 'equity'):
+        y = series[name][lo:hi]
+        indices = lttb_indices(x, y, points) if len(x) > points else np.arange(len(x))
+        traces[name] = {'x': x[indices].tolist(), 'y': y[indices].astype(np.float64).tolist()}
+    
+    fills = series['fills']
+    fills = fills[(fills['candle_index'] >= lo) & (fills['candle_index'] < hi)]
+    fill_times = timestamps[fills['candle_index']]
+    fills = fills[bucket_first_indices(fill_times, fills['direction'], MARKER_BUCKETS)] if len(fills) else fills
+    for name, direction in (('longs', OrderDirection.LONG), ('shorts', OrderDirection.SHORT)):
+        side = fills[fills['direction'] == direction]
+        traces[name] = {'x': timestamps[side['candle_index']].tolist(), 'y': side['price'].astype(np.float64).tolist()}
+    
+    return traces
+
+def plot_floats_over_time(series, series_url=None, title='Equity Curve', xlabel='Timeline', ylabel1='Asset Price', ylabel2='Portfolio'):
     # Create figure with secondary y-axis
     fig = make_subplots(specs=[[{"secondary_y": True}]])
+    traces = downsample_series(series)
 
-    # Add traces
+    # Add traces, x values are ms timestamps on a date axis
     fig.add_trace(
-        go.Scatter(x=list(range(len(asset_price))), y=asset_price, name='Asset Price', line=dict(color='blue')),
+        go.Scattergl(**traces['prices'], name='Asset Price', line=dict(color='blue')),
         secondary_y=False,
     )
 
     fig.add_trace(
-        go.Scatter(x=list(range(len(portfolio))), y=portfolio, name='Portfolio', line=dict(color='orange')),
+        go.Scattergl(**traces['equity'], name='Portfolio', line=dict(color='orange')),
         secondary_y=True,
     )
-    
-    # Extract long and short order positions
-    # long_positions = [candle for order, candle in metrics.order_history if order.direction == OrderDirection.LONG]
-    # short_positions = [candle for order, candle in metrics.order_history if order.direction == OrderDirection.SHORT]
-
-    # # Add long order arrows
-    # fig.add_trace(
-    #     go.Scatter(
-    #         x=long_positions,
-    #         y=[values1[pos] for pos in long_positions],
-    #         mode='markers',
-    #         name='Long Orders',
-    #         marker=dict(symbol='arrow-bar-up', color='green', size=10)
-    #     ),
-    #     secondary_y=False
-    # )
-
-    # # Add short order arrows
-    # fig.add_trace(
-    #     go.Scatter(
-    #         x=short_positions,
-    #         y=[values1[pos] for pos in short_positions],
-    #         mode='markers',
-    #         name='Short Orders',
-    #         marker=dict(symbol='arrow-bar-down', color='red', size=10)
-    #     ),
-    #     secondary_y=False
-    # )
+
+    # Add long and short order arrows
+    fig.add_trace(
+        go.Scattergl(**traces['longs'], mode='markers', name='Long Orders', marker=dict(symbol='triangle-up', color='green', size=8)),
+        secondary_y=False
+    )
+
+    fig.add_trace(
+        go.Scattergl(**traces['shorts'], mode='markers', name='Short Orders', marker=dict(symbol='triangle-down', color='red', size=8)),
+        secondary_y=False
+    )
 
     # Add figure title
     fig.update_layout(
@@ -149,14 +296,18 @@ def plot_floats_over_time(asset_price, portfolio, title='Equity Curve', xlabel='
     )
 
     # Set x-axis title
-    fig.update_xaxes(title_text=xlabel)
+    fig.update_xaxes(title_text=xlabel, type='date')
 
     # Set y-axes titles
     fig.update_yaxes(title_text=ylabel1, secondary_y=False)
     fig.update_yaxes(title_text=ylabel2, secondary_y=True)
 
-    # Get HTML representation of the plot
-    plot_div = pyo.plot(fig, output_type='div', include_plotlyjs=True)
+    # Get HTML representation of the plot, plotly.js is loaded from plotly_js by the page.
+    # Zooming refetches the traces of the visible range from series_url, double click resets to the full range.
+    post_script = None
+    if series_url is not None:
+        post_script = ZOOM_SCRIPT.replace('{series_url}', series_url)
+    plot_div = pio.to_html(fig, include_plotlyjs=False, full_html=False, post_script=post_script)
 
     return plot_div
 
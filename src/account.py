@@ -1,44 +1,88 @@
 from src.order_manager import OrderManager
 from src.order import *
-from src.collateral_manager import CollateralManager
+from src.collateral_manager import CollateralManager, CrossCollateralManager
 from src.position import Position
+from src.fill_model import FillModel
+from src.cost_model import CostModel
+import math
 
 '''
-For now account only handles one symbol
+Account for a single symbol. Several of them can share cross-margin collateral through a PortfolioAccount, in which case
+collateral_manager is their leg of the shared manager and starting_balance is ignored.
 '''
 class Account:
-    def __init__(self, symbol, starting_balance: float, initial_margin_ratio, maintenance_margin_ratio):
+    def __init__(self, symbol, starting_balance: float, initial_margin_ratio, maintenance_margin_ratio, fill_model: FillModel = None,
+                 incremental: bool = True, check_invariants: bool = True, liquidation: bool = True, collateral_manager = None,
+                 cost_model: CostModel = None):
         self.symbol = symbol
         self.initial_margin_ratio = initial_margin_ratio
         self.maintenance_margin_ratio = maintenance_margin_ratio
         
-        self.collateral_manager = CollateralManager(starting_balance)
+        self.collateral_manager = collateral_manager if collateral_manager is not None else CollateralManager(starting_balance, check_invariants)
         self.order_manager = OrderManager(symbol)
         self.position = Position(symbol)
+        self.fill_model = fill_model if fill_model is not None else FillModel()
+        self.cost_model = cost_model # Fees, slippage and funding, None trades for free
+        
+        # Incremental accounting only recomputes what depends on position and orders when their dirty flags are set,
+        # and skips update_pnl entirely while flat with no orders. It gives exactly the same results as the eager path.
+        self.incremental = incremental
+        self._order_net_size = 0
+        self._refreshed_balance = None
+        
+        # The account is liquidated once price reaches either of these, they only change with position, orders and balance
+        self.liquidation = liquidation
+        self.liquidation_price_low = -math.inf
+        self.liquidation_price_high = math.inf
+        
+        # on_fill(order, realized pnl, signed position size after the fill, fee) is called after every fill, e.g. Metrics.new_fill,
+        # and on_funding(payment) after every funding payment
+        self.on_fill = None
+        self.on_funding = None
 
     def add_limit_order(self, order: BaseOrder, mark_price: float):
         if order.direction == OrderDirection.LONG and order.price >= mark_price or order.direction == OrderDirection.SHORT and order.price <= mark_price:
             assert False, "Limit order would execute immediately. Review your take_profit price"
             
         self.order_manager.add_order(order)
+
+    def add_stop_order(self, order: BaseOrder, mark_price: float):
+        if order.order_type not in (OrderType.STOP_MARKET, OrderType.STOP_LIMIT):
+            raise ValueError(f"Order {order.uid} is not a stop order")
+        if order.order_type == OrderType.STOP_LIMIT and order.limit_price is None:
+            raise ValueError(f"Stop-limit order {order.uid} has no limit_price")
+        if order.direction == OrderDirection.LONG and order.price <= mark_price or order.direction == OrderDirection.SHORT and order.price >= mark_price:
+            assert False, "Stop order would trigger immediately. Review your stop_loss price"
+        
+        self.order_manager.add_order(order)
     
     def add_market_order(self, bracket_order: BracketOrder):
 
         if self.collateral_manager.has_sufficient_margin_to_open_order(bracket_order.entry_price * bracket_order.size * self.initial_margin_ratio):
+            tp_order = None
             if bracket_order.take_profit_price:
                 tp_order = BaseOrder(OrderDirection.opposite(bracket_order.direction), size=bracket_order.size, price=bracket_order.take_profit_price)
                 self.add_limit_order(tp_order, bracket_order.entry_price)
             
             if bracket_order.stop_loss_price:
-                # Added a stoploss requires new logic to execute stop-market orders.
-                # Which means BaseOrders will need a ordertype I think ( maybe we can circumvent with order group)
-                # My only issue is I'm trying to keep BaseOrder lean for future optimizations.
-                # stop_loss_order = BaseOrder(OrderDirection.opposite(bracket_order.direction), size=bracket_order.size, price=bracket_order.stop_loss_price)
-                # self.add_order(stop_loss_order)
-                pass
+                stop_loss_order = BaseOrder(OrderDirection.opposite(bracket_order.direction), size=bracket_order.size, price=bracket_order.stop_loss_price, order_type=OrderType.STOP_MARKET)
+                self.add_stop_order(stop_loss_order, bracket_order.entry_price)
+                
+                # Whichever of the take profit and stop loss fills first cancels the other
+                if tp_order is not None:
+                    tp_order.linked_uid = stop_loss_order.uid
+                    stop_loss_order.linked_uid = tp_order.uid
+            
+            entry_order = bracket_order.entry_order
+            fee = 0.0
+            if self.cost_model is not None:
+                entry_order.price = self.cost_model.slipped_price(entry_order.price, entry_order.direction)
+                fee = self.cost_model.fee(entry_order.price * entry_order.size, True)
             
-            realized_pnl = self.position.add_filled_order(bracket_order.entry_order)
-            self.collateral_manager.add_realized_pnl(realized_pnl)
+            realized_pnl = self.position.add_filled_order(entry_order)
+            self.collateral_manager.add_realized_pnl(realized_pnl - fee)
+            if self.on_fill is not None:
+                self.on_fill(entry_order, realized_pnl, self.position.signed_size, fee)
 
             return bracket_order.entry_order
         
@@ -46,17 +90,139 @@ class Account:
             # Insufficient margin - Can log or count the number of times we have insufficient margin
             return None
     
-    def check_for_filled_orders(self, low_price: float, high_price: float):
-        # Given a candle/kline this function fills all the orders that would have been executed between the low and high of that candle
+    def check_for_filled_orders(self, low_price: float, high_price: float, open_price: float = None, close_price: float = None, start: int = None,
+                                liquidate: bool = False):
+        # Given a candle/kline this function fills all the orders that would have been executed between the low and high of that candle.
+        # With the open (and optionally the close and start) of the candle, orders fill in the order the fill model says price reached them,
+        # otherwise they fill in ascending price order.
+        # With liquidate (which needs the open) the account is also liquidated at the first point of that path where price reaches the
+        # liquidation price of the position and orders as they are at that point, and the price it was liquidated at is returned.
+        if liquidate and open_price is None:
+            raise ValueError("Checking liquidation along the price path needs the open of the candle")
         
         filled_orders = self.order_manager.get_triggered_orders(low_price, high_price)
+        if not filled_orders:
+            # Nothing changes the position inside the candle, so the whole candle can be checked at once
+            return self.check_liquidation(low_price, high_price, open_price) if liquidate else None
+        
+        if open_price is None:
+            for order in filled_orders:
+                if order.uid in self.order_manager.orders: # Not cancelled by a linked order that filled before it
+                    self._fill_order(order, order.price)
+            return None
+        
+        liquidate = liquidate and self.liquidation
+        if close_price is None:
+            close_price = open_price
 
-        for order in filled_orders:
-            realized_pnl = self.position.add_filled_order(order) # Filled orders affect position
-            self.collateral_manager.add_realized_pnl(realized_pnl) # Filled orders may have realized pnl
-            self.order_manager.remove_order(order) # Filled orders should be removed from order manager
+        # A single plain limit can't interact with another order, so there is no need to work out the path. Liquidation only needs
+        # it when the account the fill left can be liquidated somewhere in the candle, the account before the fill can't be.
+        if len(filled_orders) == 1 and filled_orders[0].order_type == OrderType.LIMIT and filled_orders[0].linked_uid is None:
+            order = filled_orders[0]
+            if not liquidate:
+                self._fill_order(order, order.price)
+                return None
+            if self._liquidation_between(low_price, high_price) is None:
+                position_direction = self.position.direction
+                self._fill_order(order, order.price)
+                if self._liquidation_between(low_price, high_price) is None:
+                    return None
+                path = self.fill_model.price_path(open_price, high_price, low_price, close_price, start, position_direction)
+                return self._liquidation_after_fill(path, order)
+
+        path = self.fill_model.price_path(open_price, high_price, low_price, close_price, start, self.position.direction)
+        return self._fill_along_path(path, liquidate)
+    
+    def _fill_along_path(self, path, liquidate: bool):
+        # Orders the candle opened beyond: limits fill at their price, stops at the open they gapped to
+        for order in self.order_manager.get_orders_marketable_at(path[0]):
+            self._trigger_order(order, path[0])
+        
+        # previous is how far along the path liquidation has been checked, it is checked up to each fill with the account as it
+        # was before that fill and from there on with the account the fill left
+        previous = path[0]
+        if liquidate:
+            price = self._liquidation_between(previous, previous)
+            if price is not None:
+                return self._liquidate(price)
+        
+        for i in range(1, len(path)):
+            for order in self.order_manager.get_orders_crossed_by(path[i - 1], path[i]):
+                if liquidate:
+                    price = self._liquidation_between(previous, order.price)
+                    if price is not None:
+                        return self._liquidate(price)
+                    previous = order.price
+                self._trigger_order(order, order.price)
+            
+            if liquidate:
+                price = self._liquidation_between(previous, path[i])
+                if price is not None:
+                    return self._liquidate(price)
+                previous = path[i]
+        return None
+
+    def _liquidation_after_fill(self, path, order: BaseOrder):
+        # Checks liquidation on the part of path after the limit order filled, from the first point price reached it
+        if order.direction == OrderDirection.LONG:
+            start = next((i for i, price in enumerate(path) if price <= order.price), 0)
+        else:
+            start = next((i for i, price in enumerate(path) if price >= order.price), 0)
+
+        previous = order.price if start else path[0]
+        for price in path[start:]:
+            liquidation_price = self._liquidation_between(previous, price)
+            if liquidation_price is not None:
+                return self._liquidate(liquidation_price)
+            previous = price
+        return None
+
+    def _trigger_order(self, order: BaseOrder, price: float):
+        if order.uid not in self.order_manager.orders:
+            return  # Cancelled by an order that filled earlier on the path
+        
+        if order.order_type == OrderType.LIMIT:
+            self._fill_order(order, order.price)
+        elif order.order_type == OrderType.STOP_MARKET:
+            self._fill_order(order, price)
+        else:
+            # Stop-limit: fills now if its limit is marketable, otherwise it rests as a limit order at limit_price
+            if order.direction == OrderDirection.LONG and order.limit_price >= price or order.direction == OrderDirection.SHORT and order.limit_price <= price:
+                self._fill_order(order, price)
+            else:
+                self.order_manager.remove_order(order)
+                order.order_type = OrderType.LIMIT
+                order.price = order.limit_price
+                self.order_manager.add_order(order)
+    
+    def _fill_order(self, order: BaseOrder, price: float):
+        self.order_manager.remove_order(order) # Filled orders should be removed from order manager
+        fee = 0.0
+        if self.cost_model is not None:
+            # Triggered stops take liquidity, resting limits (including converted stop-limits) provide it
+            taker = order.is_stop
+            if taker:
+                price = self.cost_model.slipped_price(price, order.direction)
+            fee = self.cost_model.fee(price * order.size, taker)
+        
+        order.price = price
+        order.order_status = OrderStatus.FILLED
+        realized_pnl = self.position.add_filled_order(order) # Filled orders affect position
+        self.collateral_manager.add_realized_pnl(realized_pnl - fee) # Filled orders may have realized pnl
+        if self.on_fill is not None:
+            self.on_fill(order, realized_pnl, self.position.signed_size, fee)
+        
+        if order.linked_uid is not None:
+            linked_order = self.order_manager.orders.get(order.linked_uid)
+            if linked_order is not None:
+                self.order_manager.remove_order(linked_order)
+                linked_order.order_status = OrderStatus.CANCELED
 
     def _calculate_order_maintenance_margin(self, main_mark_price):
+        return self._calculate_order_net_size() * main_mark_price * self.maintenance_margin_ratio
+
+    def _calculate_order_net_size(self):
+        # Stop orders are left out, they are mostly protective and only reduce the position they guard
         long_orders_total_size = self.order_manager.long_orders.total_size
         short_orders_total_size = self.order_manager.short_orders.total_size
         
@@ -70,21 +236,148 @@ class Account:
         else:
             net_size = net_short_size
             
-        return net_size * main_mark_price * self.maintenance_margin_ratio
+        return net_size
+    
+    def _refresh(self):
+        # Recompute everything that only depends on position, orders and balance
+        self._order_net_size = self._calculate_order_net_size()
+        self._calculate_liquidation_prices()
+        self.position.dirty = self.order_manager.dirty = False
+        self._refreshed_balance = self.collateral_manager.balance
+    
+    def _needs_refresh(self):
+        return not self.incremental or self.position.dirty or self.order_manager.dirty or self._refreshed_balance != self.collateral_manager.balance
+    
+    def _calculate_liquidation_prices(self):
+        # Liquidation happens when total collateral <= maintenance margin (see CollateralManager), at price P that is
+        #   balance + external + signed_size * (P - entry_price) <= (position size + net order size) * P * maintenance_margin_ratio
+        # which is linear in P: a + b * P <= 0. external is the equity of other symbols under cross margin, held at their last mark.
+        position = self.position
+        signed_size = position.signed_size
+        k = (position.size + self._order_net_size) * self.maintenance_margin_ratio
+        a = self.collateral_manager.balance + self.collateral_manager.external_equity() - signed_size * position.entry_price
+        b = signed_size - k
+        
+        self.liquidation_price_low = -math.inf
+        self.liquidation_price_high = math.inf
+        if b > 0:
+            self.liquidation_price_low = -a / b
+        elif b < 0:
+            self.liquidation_price_high = a / -b
+        elif a <= 0:
+            self.liquidation_price_low = math.inf # Liquidated at any price
+    
+    def check_liquidation(self, low_price: float, high_price: float, open_price: float):
+        # Liquidates the account if the candle reached a liquidation price and returns the price it was liquidated at.
+        # A candle that opens beyond the liquidation price is liquidated at the open.
+        # The whole candle is checked against the current position and orders, check_for_filled_orders(..., liquidate=True)
+        # checks candles that fill orders along their price path instead.
+        if not self.liquidation:
+            return None
+        self._update_liquidation_prices()
+        
+        if low_price <= self.liquidation_price_low:
+            price = min(open_price, self.liquidation_price_low)
+        elif high_price >= self.liquidation_price_high:
+            price = max(open_price, self.liquidation_price_high)
+        else:
+            return None
+        return self._liquidate(price)
+    
+    def _liquidation_between(self, from_price: float, to_price: float):
+        # The first price at which the account is liquidated as price moves from from_price to to_price, None if it isn't
+        self._update_liquidation_prices()
+        if min(from_price, to_price) <= self.liquidation_price_low:
+            return min(from_price, self.liquidation_price_low)
+        if max(from_price, to_price) >= self.liquidation_price_high:
+            return max(from_price, self.liquidation_price_high)
+        return None
+    
+    def _update_liquidation_prices(self):
+        if self._needs_refresh():
+            self._refresh()
+        elif self.collateral_manager.is_cross:
+            self._calculate_liquidation_prices() # Moves with the other symbols' prices as well
+    
+    def _liquidate(self, price: float) -> float:
+        self.exit_market(price)
+        self.collateral_manager.liquidate()
+        return price
     
     def update_pnl(self, mark_price):
+        if self.incremental:
+            position = self.position
+            order_manager = self.order_manager
+            if position.dirty or order_manager.dirty or self._refreshed_balance != self.collateral_manager.balance:
+                self._refresh()
+            elif position.direction is None and not order_manager.orders and self.collateral_manager.is_settled():
+                return # Flat with no orders and the balance already accounted for, nothing depends on the mark price
+            open_orders_maintenance_margin = self._order_net_size * mark_price * self.maintenance_margin_ratio
+        else:
+            open_orders_maintenance_margin = self._calculate_order_maintenance_margin(mark_price)
+        
         position_unrealized_pnl = self.position.calculate_unrealized_pnl(mark_price)
         position_maintenance_margin = self.position.calculate_maintenance_margin(mark_price, self.maintenance_margin_ratio)
-        open_orders_maintenance_margin = self._calculate_order_maintenance_margin(mark_price)
         
         self.collateral_manager.update(open_orders_maintenance_margin, position_maintenance_margin, position_unrealized_pnl)
     
     def exit_market(self, mark_price):
         # liquidates position and cancels all open orders
         self.order_manager.clear_orders()
+        direction, size = self.position.direction, self.position.size
+        fee = 0.0
+        if self.cost_model is not None and direction is not None:
+            mark_price = self.cost_model.slipped_price(mark_price, direction.opposite())
+            fee = self.cost_model.fee(mark_price * size, True)
+        
         pnl = self.position.close_position(mark_price)
-        self.collateral_manager.add_realized_pnl(pnl)
+        self.collateral_manager.add_realized_pnl(pnl - fee)
+        if self.on_fill is not None and direction is not None:
+            self.on_fill(BaseOrder(direction.opposite(), size, mark_price, OrderStatus.FILLED, order_type=OrderType.MARKET), pnl, 0.0, fee)
+    
+    def apply_funding(self, rate: float, mark_price: float):
+        # Longs pay shorts rate * notional (shorts pay longs when the rate is negative)
+        if self.position.direction is None:
+            return
+        payment = -self.position.signed_size * mark_price * rate
+        self.collateral_manager.add_realized_pnl(payment)
+        if self.on_funding is not None:
+            self.on_funding(payment)
     
     def __str__(self):
         return (f"Account(symbol={self.symbol}, "
-                f"Total Collateral={self.collateral_manager.total_collateral})")
\ No newline at end of file
+                f"Total Collateral={self.collateral_manager.total_collateral})")
+
+'''
+Cross-margin account over many symbols: one Account (order manager and position) per symbol, all drawing on one CrossCollateralManager.
+A liquidation on any symbol closes every position at its last mark price.
+'''
+class PortfolioAccount:
+    def __init__(self, symbols, starting_balance: float, initial_margin_ratio, maintenance_margin_ratio, fill_model: FillModel = None,
+                 incremental: bool = True, check_invariants: bool = True, liquidation: bool = True, cost_model = None):
+        # cost_model is one CostModel for every symbol, or a dict of them by symbol (funding rates differ per symbol)
+        self.collateral_manager = CrossCollateralManager(starting_balance, check_invariants)
+        self.collateral_manager.on_liquidation = self._close_all
+        self.accounts = {
+            symbol: Account(symbol, starting_balance, initial_margin_ratio, maintenance_margin_ratio, fill_model,
+                            incremental, check_invariants, liquidation, self.collateral_manager.leg(symbol),
+                            cost_model.get(symbol) if isinstance(cost_model, dict) else cost_model)
+            for symbol in symbols
+        }
+        self.mark_prices = {}
+
+    def update_pnl(self, symbol, mark_price):
+        self.mark_prices[symbol] = mark_price
+        self.accounts[symbol].update_pnl(mark_price)
+
+    def _close_all(self, liquidated_symbol):
+        for symbol, account in self.accounts.items():
+            if symbol != liquidated_symbol and (account.position.direction is not None or account.order_manager.orders):
+                account.exit_market(self.mark_prices[symbol])
+
+    def __getitem__(self, symbol) -> Account:
+        return self.accounts[symbol]
+
+    def __str__(self):
+        return (f"PortfolioAccount(symbols={len(self.accounts)}, "
+                f"Total Collateral={self.collateral_manager.total_collateral})")
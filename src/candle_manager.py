@@ -1,16 +1,58 @@
-from itertools import product
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, List, Optional, Sequence, Tuple
+import heapq
+import os
+import re
+import warnings
 import numpy as np
 
-def preprocess_candles(candles: List[dict]) -> np.ndarray:
-    dtype = np.dtype([
-        ('start', 'i8'),
-        ('open', 'f8'),
-        ('high', 'f8'),
-        ('low', 'f8'),
-        ('close', 'f8')
-    ])
+CANDLE_DTYPE = np.dtype([
+    ('start', 'i8'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8')
+])
+
+# On-disk candle store: a directory next to the source json holding the candles as a .npy file
+# with CANDLE_DTYPE records, so it can be memory-mapped straight back into the array the simulation uses.
+STORE_SUFFIX = '.store'
+CANDLES_FILE = 'candles.npy'
+DAY_INDEX_FILE = 'day_index.npy'
+GAPS_FILE = 'gaps.npy'
+# Resampled levels of the store, keyed by timeframe in ms. Counts hold how many source candles went into each bar.
+RESAMPLED_FILE = 'candles_{}.npy'
+RESAMPLED_COUNTS_FILE = 'counts_{}.npy'
+
+# Ingestion reads the source in chunks of about this many bytes, so memory stays bounded whatever the file size
+INGEST_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Json candles are parsed by stripping the punctuation and key names and handing the numbers left to numpy in one call.
+# Chunks that don't fit that (exponents, non-numeric fields, ...) fall back to one regex scan per field.
+_JSON_PUNCTUATION = bytes.maketrans(b'{}[]:,"', b'       ')
+_JSON_LETTERS = bytes(range(ord('a'), ord('z') + 1)) + bytes(range(ord('A'), ord('Z') + 1)) + b'_'
+_JSON_NON_LETTERS = bytes(byte for byte in range(256) if byte not in _JSON_LETTERS)
+_JSON_KEY_PATTERN = re.compile(rb'"(\w+)"\s*:')
+# Matches the value of each field in exchange json dumps, quoted or not: {"start": "1719792000000", "open": "140.0", ...}
+_JSON_FIELD_PATTERNS = {name: re.compile(rb'"' + name.encode() + rb'"\s*:\s*"?([-+0-9.eE]+)') for name in CANDLE_DTYPE.names}
+# Accepted csv header names for the start column
+_CSV_START_COLUMNS = ('start', 'timestamp', 'time', 'open_time')
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+TIMEFRAME_UNITS_MS = {'m': 60 * 1000, 'h': 60 * 60 * 1000, 'd': DAY_MS}
+# Timeframes build_candle_pyramid caches by default, each one is resampled from the largest cached timeframe that divides it
+PYRAMID_TIMEFRAMES = ('3m', '5m', '15m', '30m', '1h', '4h', '8h', '1d')
 
+# Sparse timestamp index: one entry per UTC day holding the day number and the position of its first candle
+DAY_INDEX_DTYPE = np.dtype([
+    ('day', 'i8'),
+    ('offset', 'i8')
+])
+
+def preprocess_candles(candles: List[dict]) -> np.ndarray:
     preprocessed = np.array([
         (   
             int(k["start"]),
@@ -20,37 +62,478 @@ def preprocess_candles(candles: List[dict]) -> np.ndarray:
             float(k["close"])
         )
         for k in candles
-    ], dtype=dtype)
+    ], dtype=CANDLE_DTYPE)
 
     return preprocessed
 
+def candle_store_dir(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + STORE_SUFFIX
+
+def build_candle_store(json_path: str, store_dir: Optional[str] = None, n_jobs: int = 1) -> str:
+    # One-off conversion of a json (or csv) candle dump into the binary store. Returns the store directory.
+    # The candles are streamed straight into the memory-mapped store file, see ingest_candles.
+    store_dir = store_dir or candle_store_dir(json_path)
+
+    os.makedirs(store_dir, exist_ok=True)
+    candles = ingest_candles(json_path, os.path.join(store_dir, CANDLES_FILE), n_jobs=n_jobs)
+    _save_array(os.path.join(store_dir, DAY_INDEX_FILE), build_day_index(candles))
+    _save_array(os.path.join(store_dir, GAPS_FILE), find_gaps(candles))
+
+    return store_dir
+
+def ingest_candles(path: str, out_path: Optional[str] = None, chunk_bytes: int = INGEST_CHUNK_BYTES, n_jobs: int = 1) -> np.ndarray:
+    # Parses a json or csv candle dump chunk by chunk. A first pass counts the candles so the second can write each chunk
+    # straight into a preallocated array, which is a .npy memmap at out_path when given (written atomically) or in memory.
+    # Raises ValueError if start times are duplicated or go backwards.
+    count = count_candles(path, chunk_bytes)
+
+    tmp_path = out_path + '.tmp' if out_path else None
+    if tmp_path:
+        candles = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=CANDLE_DTYPE, shape=(count,))
+    else:
+        candles = np.empty(count, dtype=CANDLE_DTYPE)
+
+    filled = 0
+    previous_start = None
+    for chunk in iter_candle_chunks(path, chunk_bytes, n_jobs):
+        if filled + len(chunk) > count:
+            raise ValueError(f"{path} has more candles than counted ({count}), is it being written to?")
+        _check_order(chunk['start'], previous_start, filled, path)
+        candles[filled:filled + len(chunk)] = chunk
+        filled += len(chunk)
+        previous_start = chunk['start'][-1]
+
+    if filled != count:
+        raise ValueError(f"{path}: counted {count} candles but parsed {filled}, check for blank lines or malformed rows")
+
+    if tmp_path:
+        candles.flush()
+        del candles
+        os.replace(tmp_path, out_path)
+        return np.load(out_path, mmap_mode='r')
+    return candles
+
+def count_candles(path: str, chunk_bytes: int = INGEST_CHUNK_BYTES) -> int:
+    is_csv = _is_csv(path)
+    marker = b'\n' if is_csv else b'"start"'
+    count = 0
+    tail = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            # The tail of the previous chunk catches markers split across the boundary, it is too short to hold a whole one
+            count += (tail + chunk).count(marker)
+            tail = chunk[-(len(marker) - 1):] if len(marker) > 1 else b''
+            last_byte = chunk[-1:]
+
+    if is_csv and count:
+        count += last_byte != b'\n' # Last row without a trailing newline
+        count -= 1 # Header
+    return max(count, 0)
+
+def iter_candle_chunks(path: str, chunk_bytes: int = INGEST_CHUNK_BYTES, n_jobs: int = 1) -> Iterator[np.ndarray]:
+    # Yields the candles of a json or csv dump as CANDLE_DTYPE arrays of roughly chunk_bytes of source each.
+    # n_jobs > 1 parses chunks in worker processes, with at most two chunks per worker in flight so memory stays bounded.
+    if _is_csv(path):
+        buffers = _iter_source_buffers(path, chunk_bytes, b'\n', skip_header=True)
+        parse = partial(_parse_csv_chunk, columns=_csv_columns(path), path=path)
+    else:
+        # Chunks are cut after the last complete candle object and the rest is carried into the next one
+        buffers = _iter_source_buffers(path, chunk_bytes, b'}')
+        parse = partial(_parse_json_chunk, path=path)
+
+    if n_jobs <= 1:
+        for buffer in buffers:
+            chunk = parse(buffer)
+            if len(chunk):
+                yield chunk
+        return
+
+    with ProcessPoolExecutor(n_jobs) as executor:
+        pending = deque()
+        for buffer in buffers:
+            pending.append(executor.submit(parse, buffer))
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _iter_source_buffers(path: str, chunk_bytes: int, boundary: bytes, skip_header: bool = False) -> Iterator[bytes]:
+    # Reads the file in chunks cut after the last boundary byte, carrying the rest into the next chunk
+    carry = b''
+    with open(path, 'rb') as f:
+        if skip_header:
+            f.readline()
+        while True:
+            data = f.read(chunk_bytes)
+            if not data:
+                if carry.strip():
+                    yield carry
+                return
+            buffer = carry + data
+            end = buffer.rfind(boundary) + 1
+            carry = buffer[end:]
+            if end:
+                yield buffer[:end]
+
+def _parse_json_chunk(buffer: bytes, path: str) -> np.ndarray:
+    chunk = _parse_json_chunk_fast(buffer)
+    if chunk is not None:
+        return chunk
+
+    values = {name: pattern.findall(buffer) for name, pattern in _JSON_FIELD_PATTERNS.items()}
+
+    count = len(values['start'])
+    for name, field_values in values.items():
+        if len(field_values) != count:
+            raise ValueError(f"{path}: found {len(field_values)} '{name}' values for {count} candles")
+
+    chunk = np.empty(count, dtype=CANDLE_DTYPE)
+    if count:
+        for name, field_values in values.items():
+            chunk[name] = np.array(field_values).astype(CANDLE_DTYPE[name])
+    return chunk
+
+def _parse_json_chunk_fast(buffer: bytes) -> Optional[np.ndarray]:
+    # Needs every candle object to list the same fields in the same order as the first one, which holds for exchange dumps.
+    # Returns None when the chunk doesn't look like that so the caller can parse it field by field.
+    count = buffer.count(b'"start"')
+    if not count:
+        return np.empty(0, dtype=CANDLE_DTYPE)
+
+    first_key = buffer.find(b'"start"')
+    object_start = buffer.rfind(b'{', 0, first_key)
+    object_end = buffer.find(b'}', first_key)
+    keys = _JSON_KEY_PATTERN.findall(buffer, object_start, object_end)
+    if object_start < 0 or object_end < 0 or any(name.encode() not in keys for name in CANDLE_DTYPE.names):
+        return None
+
+    # With everything but letters removed, a chunk of identically laid out objects with only plain numbers (no exponents,
+    # strings or nulls) as values is the first object's keys repeated
+    candles_text = buffer[object_start:]
+    if candles_text.translate(None, _JSON_NON_LETTERS) != b''.join(keys) * count:
+        return None
+    keys = [key.decode() for key in keys]
+
+    numbers = candles_text.translate(_JSON_PUNCTUATION, _JSON_LETTERS)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # numpy warns when it stops at something that isn't a number, the count check catches it
+        values = np.fromstring(numbers, sep=' ')
+    if len(values) != count * len(keys):
+        return None
+
+    values = values.reshape(count, len(keys))
+    starts = values[:, keys.index('start')]
+    if np.abs(starts).max() >= 2 ** 53:
+        return None # Timestamps too large to go through a float exactly
+
+    chunk = np.empty(count, dtype=CANDLE_DTYPE)
+    for name in CANDLE_DTYPE.names:
+        chunk[name] = values[:, keys.index(name)]
+    return chunk
+
+def _csv_columns(path: str) -> List[int]:
+    # Positions of the start, open, high, low and close columns from the csv header
+    with open(path, 'r') as f:
+        header = [column.strip().strip('"').lower() for column in f.readline().split(',')]
+    start_column = next((header.index(name) for name in _CSV_START_COLUMNS if name in header), None)
+    if start_column is None or any(name not in header for name in CANDLE_DTYPE.names[1:]):
+        raise ValueError(f"{path}: csv header needs a start column ({', '.join(_CSV_START_COLUMNS)}) and open, high, low, close, got {header}")
+    return [start_column] + [header.index(name) for name in CANDLE_DTYPE.names[1:]]
+
+def _parse_csv_chunk(buffer: bytes, columns: List[int], path: str) -> np.ndarray:
+    lines = buffer.decode().splitlines()
+    if not lines:
+        return np.empty(0, dtype=CANDLE_DTYPE)
+    try:
+        return np.loadtxt(lines, delimiter=',', dtype=CANDLE_DTYPE, usecols=columns, ndmin=1)
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from e
+
+def _check_order(starts: np.ndarray, previous_start, offset: int, path: str):
+    if previous_start is not None and len(starts):
+        starts = np.concatenate(([previous_start], starts))
+        offset -= 1
+    steps = np.diff(starts)
+    if len(steps) and steps.min() <= 0:
+        index = int(np.flatnonzero(steps <= 0)[0]) + 1
+        problem = "duplicate" if steps[index - 1] == 0 else "out of order"
+        raise ValueError(f"{path}: {problem} start time {int(starts[index])} at candle {offset + index}")
+
+def find_gaps(candles: np.ndarray, interval_ms: Optional[int] = None) -> np.ndarray:
+    # Indices of the candles that start more than one interval after the previous candle. The interval defaults to
+    # the smallest step between candles, so missing minutes in 1m data show up as gaps.
+    steps = np.diff(candles['start'])
+    if not interval_ms:
+        positive_steps = steps[steps > 0]
+        if not len(positive_steps):
+            return np.empty(0, dtype='i8')
+        interval_ms = int(positive_steps.min())
+    return np.flatnonzero(steps > interval_ms) + 1
+
+def load_gaps(json_path: str) -> Optional[np.ndarray]:
+    # Gaps found when the store was built, None if the store predates them
+    gaps_path = os.path.join(candle_store_dir(json_path), GAPS_FILE)
+    if not os.path.exists(gaps_path):
+        return None
+    return np.load(gaps_path)
+
+def load_candles(json_path: str, mmap: bool = True) -> np.ndarray:
+    # Memory-maps the binary store for json_path, (re)building it first if it is missing or older than the json.
+    # Pages are only read from disk when the slice of candles that touches them is accessed.
+    store_dir = candle_store_dir(json_path)
+    candles_path = os.path.join(store_dir, CANDLES_FILE)
+
+    if _is_stale(candles_path, json_path):
+        build_candle_store(json_path, store_dir)
+
+    return np.load(candles_path, mmap_mode='r' if mmap else None)
+
+def load_day_index(json_path: str) -> Optional[np.ndarray]:
+    # Returns the day index saved next to the candles by build_candle_store, or None if the store predates it
+    index_path = os.path.join(candle_store_dir(json_path), DAY_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    return np.load(index_path)
+
+def build_day_index(candles: np.ndarray) -> np.ndarray:
+    days = candles['start'] // DAY_MS
+    offsets = np.flatnonzero(np.diff(days, prepend=days[0] - 1)) if len(days) else np.empty(0, dtype='i8')
+
+    day_index = np.empty(len(offsets), dtype=DAY_INDEX_DTYPE)
+    day_index['day'] = days[offsets]
+    day_index['offset'] = offsets
+    return day_index
+
+def find_candle_range(candles: np.ndarray, start_ts: int, end_ts: int, day_index: Optional[np.ndarray] = None) -> Tuple[int, int]:
+    # Returns (start_index, end_index) such that candles[start_index:end_index] covers every candle with start_ts <= start < end_ts.
+    # With a day index the binary search is narrowed to the days touching each bound, so only a handful of pages are read.
+    return (_search_start(candles, start_ts, day_index), _search_start(candles, end_ts, day_index))
+
+def get_candle_range(candles: np.ndarray, start_ts: int, end_ts: int, day_index: Optional[np.ndarray] = None) -> np.ndarray:
+    start_index, end_index = find_candle_range(candles, start_ts, end_ts, day_index)
+    return candles[start_index:end_index]
+
+def parse_timeframe(timeframe) -> int:
+    # Timeframe in ms from e.g. '15m', '4h', '1d'/'1D', or an int already in ms
+    if isinstance(timeframe, (int, np.integer)):
+        timeframe_ms = int(timeframe)
+    else:
+        match = re.fullmatch(r'(\d+)([mhdD])', timeframe.strip())
+        if not match:
+            raise ValueError(f"Invalid timeframe '{timeframe}', expected e.g. '5m', '4h' or '1d'")
+        timeframe_ms = int(match.group(1)) * TIMEFRAME_UNITS_MS[match.group(2).lower()]
+    if timeframe_ms <= 0:
+        raise ValueError(f"Timeframe must be positive, got {timeframe}")
+    return timeframe_ms
+
+def resample_candles(candles: np.ndarray, timeframe, counts: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    # Aggregates candles into bars of timeframe aligned to the unix epoch (so days start at 00:00 UTC).
+    # Returns the bars as CANDLE_DTYPE, each starting at its bucket start, and how many source candles went into each bar.
+    # Gaps produce no bar rather than a made up one, and a bar with fewer candles than the timeframe holds
+    # (e.g. the last, still forming bar of a dump) is partial: counts < timeframe_ms // source interval.
+    # counts gives the source candles' own counts when resampling an already resampled series.
+    timeframe_ms = parse_timeframe(timeframe)
+    starts = candles['start']
+    buckets = starts // timeframe_ms
+    
+    if not len(candles):
+        return np.empty(0, dtype=CANDLE_DTYPE), np.empty(0, dtype='i8')
+    
+    first = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+    last = np.append(first[1:], len(candles)) - 1
+    
+    resampled = np.empty(len(first), dtype=CANDLE_DTYPE)
+    resampled['start'] = buckets[first] * timeframe_ms
+    resampled['open'] = candles['open'][first]
+    resampled['high'] = np.maximum.reduceat(candles['high'], first)
+    resampled['low'] = np.minimum.reduceat(candles['low'], first)
+    resampled['close'] = candles['close'][last]
+    
+    bar_counts = np.diff(np.append(first, len(candles))) if counts is None else np.add.reduceat(counts, first)
+    return resampled, bar_counts.astype('i8')
+
+def load_resampled_candles(json_path: str, timeframe, mmap: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    # Bars and source candle counts of json_path's candles at timeframe, from the store's pyramid. Missing or stale levels are built.
+    timeframe_ms = parse_timeframe(timeframe)
+    store_dir = candle_store_dir(json_path)
+    candles = load_candles(json_path, mmap)
+    
+    resampled_path = os.path.join(store_dir, RESAMPLED_FILE.format(timeframe_ms))
+    counts_path = os.path.join(store_dir, RESAMPLED_COUNTS_FILE.format(timeframe_ms))
+    if _is_stale(resampled_path, os.path.join(store_dir, CANDLES_FILE)) or not os.path.exists(counts_path):
+        _build_pyramid_level(store_dir, candles, timeframe_ms)
+    
+    mmap_mode = 'r' if mmap else None
+    return np.load(resampled_path, mmap_mode=mmap_mode), np.load(counts_path, mmap_mode=mmap_mode)
+
+def build_candle_pyramid(json_path: str, timeframes = PYRAMID_TIMEFRAMES):
+    # Caches every timeframe in the store, smallest first so each level can be built from a smaller one
+    for timeframe_ms in sorted(parse_timeframe(timeframe) for timeframe in timeframes):
+        load_resampled_candles(json_path, timeframe_ms)
+
+def _build_pyramid_level(store_dir: str, candles: np.ndarray, timeframe_ms: int):
+    # Resample from the largest fresh cached level that divides timeframe_ms, which is much smaller than the base candles
+    candles_path = os.path.join(store_dir, CANDLES_FILE)
+    source, source_counts, source_timeframe = candles, None, 0
+    for name in os.listdir(store_dir):
+        match = re.fullmatch(RESAMPLED_FILE.format(r'(\d+)'), name)
+        if not match:
+            continue
+        level_ms = int(match.group(1))
+        level_path = os.path.join(store_dir, name)
+        counts_path = os.path.join(store_dir, RESAMPLED_COUNTS_FILE.format(level_ms))
+        if level_ms < timeframe_ms and timeframe_ms % level_ms == 0 and level_ms > source_timeframe \
+                and not _is_stale(level_path, candles_path) and os.path.exists(counts_path):
+            source_timeframe = level_ms
+    
+    if source_timeframe:
+        source = np.load(os.path.join(store_dir, RESAMPLED_FILE.format(source_timeframe)), mmap_mode='r')
+        source_counts = np.load(os.path.join(store_dir, RESAMPLED_COUNTS_FILE.format(source_timeframe)))
+    
+    resampled, counts = resample_candles(source, timeframe_ms, source_counts)
+    _save_array(os.path.join(store_dir, RESAMPLED_COUNTS_FILE.format(timeframe_ms)), counts)
+    _save_array(os.path.join(store_dir, RESAMPLED_FILE.format(timeframe_ms)), resampled)
+
+def merge_candle_streams(streams: Sequence[np.ndarray], start_indices: Optional[Sequence[int]] = None) -> Iterator[Tuple[int, List[Tuple[int, int]]]]:
+    # Aligns several candle arrays (e.g. one per symbol) on their start timestamps. Yields (start, printed) for every distinct
+    # start in time order, where printed lists (stream, index) for each stream that has a candle at that start.
+    # A heap keyed by each stream's next start means a bar only costs the streams that printed in it.
+    starts = [stream['start'] for stream in streams]
+    start_indices = start_indices or [0] * len(streams)
+    
+    heap = [(int(starts[stream][index]), stream, index) for stream, index in enumerate(start_indices) if index < len(starts[stream])]
+    heapq.heapify(heap)
+    
+    while heap:
+        start = heap[0][0]
+        printed = []
+        while heap and heap[0][0] == start:
+            _, stream, index = heap[0]
+            printed.append((stream, index))
+            index += 1
+            if index < len(starts[stream]):
+                heapq.heapreplace(heap, (int(starts[stream][index]), stream, index))
+            else:
+                heapq.heappop(heap)
+        yield start, printed
+
+def _search_start(candles: np.ndarray, ts: int, day_index: Optional[np.ndarray]) -> int:
+    # Index of the first candle whose start is >= ts
+    lo, hi = 0, len(candles)
+
+    if day_index is not None:
+        # Every candle before the first indexed day >= ts's day starts before ts, and the answer is at most the next day's first candle
+        day_position = int(np.searchsorted(day_index['day'], ts // DAY_MS, side='left'))
+        if day_position == len(day_index):
+            return len(candles)
+        lo = int(day_index['offset'][day_position])
+        if day_position + 1 < len(day_index):
+            hi = int(day_index['offset'][day_position + 1])
+
+    return lo + int(np.searchsorted(candles['start'][lo:hi], ts, side='left'))
+
+def _is_csv(path: str) -> bool:
+    return path.lower().endswith('.csv')
+
+def _is_stale(path: str, source_path: str) -> bool:
+    if not os.path.exists(path):
+        return True
+    return os.path.exists(source_path) and os.path.getmtime(source_path) > os.path.getmtime(path)
+
+def _save_array(path: str, array: np.ndarray):
+    # Write to a temporary file and rename so a reader never maps a half written store
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
 def is_candle_bullish(candle):
     return candle['close'] > candle['open']
 
 def is_candle_bearish(candle):
     return candle['close'] < candle['open']
 
+# Candle directions used by the pattern encoding. Binary patterns only use BEARISH and BULLISH, ternary ones add DOJI.
+BEARISH = 0
+BULLISH = 1
+DOJI = 2
+
+def encode_candles(candles: np.ndarray, doji_threshold: float = 0.0) -> np.ndarray:
+    # One direction per candle. A candle is a doji when its body is at most doji_threshold of its open (exactly flat by default).
+    opens = candles['open']
+    closes = candles['close']
+    directions = np.where(closes > opens, BULLISH, BEARISH).astype(np.int8)
+    directions[np.abs(closes - opens) <= doji_threshold * np.abs(opens)] = DOJI
+    return directions
+
+def pattern_code(pattern, ternary: bool = False) -> int:
+    # Patterns are read oldest candle first, which is the most significant digit, so codes follow product() order
+    base = 3 if ternary else 2
+    code = 0
+    for direction in pattern:
+        code = code * base + direction
+    return code
+
+def pattern_from_code(code: int, pattern_length: int, ternary: bool = False) -> Tuple[int, ...]:
+    base = 3 if ternary else 2
+    pattern = []
+    for _ in range(pattern_length):
+        code, direction = divmod(code, base)
+        pattern.append(direction)
+    return tuple(reversed(pattern))
+
+def pattern_codes(directions: np.ndarray, pattern_length: int, ternary: bool = False) -> np.ndarray:
+    # Code of the pattern formed by each window of pattern_length candles that has a candle after it.
+    # Binary codes are -1 for windows containing a doji since they match no pattern.
+    base = 3 if ternary else 2
+    window_count = max(len(directions) - pattern_length, 0)
+    code_type = np.int32 if base ** pattern_length < 2 ** 31 else np.int64
+
+    codes = np.zeros(window_count, dtype=code_type)
+    for offset in range(pattern_length):
+        codes *= base
+        codes += directions[offset:offset + window_count]
+
+    if not ternary:
+        # A window holds a doji if the running doji count changes across it
+        dojis = np.concatenate(([0], np.cumsum(directions == DOJI)))
+        codes[dojis[pattern_length:pattern_length + window_count] != dojis[:window_count]] = -1
+    return codes
+
+def pattern_statistics(candles: np.ndarray, pattern_length: int, ternary: bool = False, doji_threshold: float = 0.0) -> dict:
+    # Counts of every pattern of pattern_length candles and of the direction of the candle that followed it, indexed by pattern_code.
+    # Binary statistics count a doji after the pattern as bearish, ternary ones count it separately under 'doji_next'.
+    directions = encode_candles(candles, doji_threshold)
+    codes = pattern_codes(directions, pattern_length, ternary)
+    next_directions = directions[pattern_length:pattern_length + len(codes)]
+
+    pattern_count = (3 if ternary else 2) ** pattern_length
+    matched = codes >= 0
+    codes = codes[matched]
+    next_directions = next_directions[matched]
+
+    statistics = {
+        'total': np.bincount(codes, minlength=pattern_count),
+        'bullish_next': np.bincount(codes[next_directions == BULLISH], minlength=pattern_count),
+    }
+    if ternary:
+        statistics['doji_next'] = np.bincount(codes[next_directions == DOJI], minlength=pattern_count)
+        statistics['bearish_next'] = statistics['total'] - statistics['bullish_next'] - statistics['doji_next']
+    else:
+        statistics['bearish_next'] = statistics['total'] - statistics['bullish_next']
+    return statistics
+
 def search_for_candle_pattern(candles, pattern = [1, 0, 1, 1, 1]):
+    directions = encode_candles(candles)
+    codes = pattern_codes(directions, len(pattern))
+    matches = np.flatnonzero(codes == pattern_code(pattern))
     
-    total_patterns = 0
-    bullish_next_candles = 0
-    bearish_next_candles = 0
-
-    for i in range(len(candles) - len(pattern)):
-        is_pattern = True
-        for j in range(len(pattern)):
-            if pattern[j] == 0 and not is_candle_bearish(candles[i+j]):
-                is_pattern = False
-                break
-            elif pattern[j] == 1 and not is_candle_bullish(candles[i+j]):
-                is_pattern = False
-                break
-        if is_pattern:
-            total_patterns += 1
-            if is_candle_bullish(candles[i + len(pattern)]):
-                bullish_next_candles += 1
-            else:
-                bearish_next_candles += 1
+    total_patterns = len(matches)
+    bullish_next_candles = int(np.count_nonzero(directions[matches + len(pattern)] == BULLISH))
+    bearish_next_candles = total_patterns - bullish_next_candles
 
     results = {
         "total_patterns": total_patterns,
@@ -60,18 +543,28 @@ def search_for_candle_pattern(candles, pattern = [1, 0, 1, 1, 1]):
 
     return results
 
-def analyze_patterns(candles, pattern_length: int):
-    patterns = list(product([0, 1], repeat=pattern_length))
-    best_patterns = []
+def analyze_patterns(candles, pattern_length: int, ternary: bool = False, doji_threshold: float = 0.0, top: int = 10):
+    statistics = pattern_statistics(candles, pattern_length, ternary, doji_threshold)
+    totals = statistics['total']
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bullish_percentages = np.where(totals > 0, statistics['bullish_next'] / totals * 100, 0)
+        bearish_percentages = np.where(totals > 0, statistics['bearish_next'] / totals * 100, 0)
 
-    for pattern in patterns:
-        result = search_for_candle_pattern(candles, pattern)
+    # Sort by bullish_next_percentage and total_patterns to find the most predictive patterns, ties keep pattern order
+    order = np.lexsort((np.arange(len(totals)), -totals, -bullish_percentages))[:top]
+    
+    best_patterns = []
+    for code in order.tolist():
+        pattern = pattern_from_code(code, pattern_length, ternary)
+        result = {
+            "total_patterns": int(totals[code]),
+            "bullish_next_percentage": float(bullish_percentages[code]),
+            "bearish_next_percentage": float(bearish_percentages[code])
+        }
         best_patterns.append((pattern, result))
-
-    # Sort by bullish_next_percentage and total_patterns to find the most predictive patterns
-    best_patterns.sort(key=lambda x: (x[1]['bullish_next_percentage'], x[1]['total_patterns']), reverse=True)
-
-    for pattern, result in best_patterns[:10]:  # Print top 10 patterns for brevity
         print(f"Pattern: {pattern}, Total Patterns: {result['total_patterns']}, "
             f"Bullish Next %: {result['bullish_next_percentage']:.2f}, "
-            f"Bearish Next %: {result['bearish_next_percentage']:.2f}")
\ No newline at end of file
+            f"Bearish Next %: {result['bearish_next_percentage']:.2f}")
+    
+    return best_patterns
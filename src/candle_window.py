@@ -0,0 +1,230 @@
+from typing import Optional
+import numpy as np
+from src.candle_manager import parse_timeframe, resample_candles
+
+class LookAheadError(KeyError):
+    pass
+
+'''
+The candle currently being simulated. Only its start and open are known when the strategy runs,
+reading any other field raises LookAheadError.
+'''
+class FormingCandle:
+    __slots__ = ('_window',)
+
+    def __init__(self, window: 'CandleWindow'):
+        self._window = window
+
+    def __getitem__(self, field: str):
+        if field == 'open':
+            return self._window.current_open
+        if field == 'start':
+            return self._window.current_start
+        raise LookAheadError(f"'{field}' of the current candle is not known until it closes")
+
+    def __repr__(self) -> str:
+        return f"FormingCandle(start={self._window.current_start}, open={self._window.current_open})"
+
+'''
+Append-only view over a preloaded candle array. The window grows by one candle per advance() without copying,
+the last candle is always the forming one (see FormingCandle) and everything before it is closed history.
+lookback caps how many closed candles stay visible, None keeps the full history.
+
+Integer indexing is relative to the window like a list: window[-1] is the forming candle, window[-2] the last closed one.
+Slices are relative to the window as well but never include the forming candle.
+'''
+class CandleWindow:
+    def __init__(self, candles: np.ndarray, lookback: Optional[int] = None, start: int = 0):
+        self.candles = candles
+        self.lookback = lookback
+
+        self._starts = candles['start']
+        self._opens = candles['open']
+        self._forming = FormingCandle(self)
+
+        # candles[_begin:_end] are visible, candles[_end - 1] is forming
+        self._begin = 0
+        self._end = start
+        self._clamp_begin()
+
+    def advance(self):
+        self._end += 1
+        if self.lookback is not None and self._end - self._begin > self.lookback + 1:
+            self._begin += 1
+
+    def seek(self, index: int):
+        # Make candles[index] the forming candle
+        self._end = index + 1
+        self._clamp_begin()
+
+    @property
+    def index(self) -> int:
+        # Position of the forming candle in the underlying array
+        return self._end - 1
+
+    @property
+    def current_open(self) -> float:
+        return self._opens[self._end - 1]
+
+    @property
+    def current_start(self) -> int:
+        return self._starts[self._end - 1]
+
+    @property
+    def current(self) -> FormingCandle:
+        return self._forming
+
+    @property
+    def closed(self) -> np.ndarray:
+        return self.candles[self._begin:self._end - 1]
+
+    @property
+    def last_closed(self):
+        return self.candles[self._end - 2] if self._end - 1 > self._begin else None
+
+    def __len__(self) -> int:
+        return self._end - self._begin
+
+    def __getitem__(self, key):
+        length = self._end - self._begin
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(length)
+            if step > 0:
+                return self.candles[self._begin + start:self._begin + max(start, min(stop, length - 1)):step]
+            # Reversed slices can run past position 0, which a plain slice can't express, so fall back to a (copying) index array
+            return self.candles[self._begin + np.arange(min(start, length - 2), stop, step)]
+
+        if key < 0:
+            key += length
+        if not 0 <= key < length:
+            raise IndexError("candle window index out of range")
+        if key == length - 1:
+            return self._forming
+        return self.candles[self._begin + key]
+
+    def __iter__(self):
+        yield from self.closed
+        if self._end > self._begin:
+            yield self._forming
+
+    def _clamp_begin(self):
+        if self.lookback is not None:
+            self._begin = max(0, self._end - 1 - self.lookback)
+        else:
+            self._begin = 0
+
+    def __repr__(self) -> str:
+        return f"CandleWindow(index={self.index}, length={len(self)}, lookback={self.lookback})"
+
+'''
+The higher timeframe bar the current candle belongs to. Its open, and its high and low so far (the closed candles of the bar
+plus the current open), are known. Its close is not known until the bar closes.
+'''
+class FormingBar:
+    __slots__ = ('_view',)
+
+    def __init__(self, view: 'TimeframeWindow'):
+        self._view = view
+
+    def __getitem__(self, field: str):
+        view = self._view
+        view._sync()
+        if field == 'start':
+            return view._bar_start
+        if field == 'open':
+            return view._open
+        if field == 'high':
+            return view._high
+        if field == 'low':
+            return view._low
+        raise LookAheadError(f"'{field}' of the current {view.timeframe_ms} ms bar is not known until it closes")
+
+    def __repr__(self) -> str:
+        return f"FormingBar(start={self['start']}, open={self['open']}, high={self['high']}, low={self['low']})"
+
+'''
+Look-ahead safe view of a CandleWindow resampled to a higher timeframe. It follows the window as it advances:
+view[-1] is the forming bar (see FormingBar), view[-2] the last closed one, and closed holds every bar that closed before
+the current candle. resampled can be passed in (e.g. from load_resampled_candles) to skip resampling the window's candles.
+'''
+class TimeframeWindow:
+    def __init__(self, window: CandleWindow, timeframe, resampled: Optional[np.ndarray] = None):
+        self.window = window
+        self.timeframe_ms = parse_timeframe(timeframe)
+        self.resampled = resampled if resampled is not None else resample_candles(window.candles, self.timeframe_ms)[0]
+        
+        self._forming = FormingBar(self)
+        self._index = None # Window index the cached bar state was computed for
+        self._bar = 0 # Position of the forming bar in resampled
+        self._bar_start = None
+        self._open = None
+        self._high = None
+        self._low = None
+
+    def _sync(self):
+        window = self.window
+        index = window.index
+        if index == self._index:
+            return
+        
+        candles = window.candles
+        current_start = int(window.current_start)
+        current_open = window.current_open
+        bar_start = current_start - current_start % self.timeframe_ms
+        
+        if self._index is not None and index == self._index + 1 and bar_start == self._bar_start:
+            # Same bar as the previous candle, which has closed since: fold it in
+            previous = candles[index - 1]
+            self._high = max(self._high, previous['high'], current_open)
+            self._low = min(self._low, previous['low'], current_open)
+        else:
+            first = int(np.searchsorted(candles['start'][:index + 1], bar_start, side='left'))
+            closed = candles[first:index]
+            self._open = candles['open'][first]
+            self._high = max(closed['high'].max(), current_open) if len(closed) else current_open
+            self._low = min(closed['low'].min(), current_open) if len(closed) else current_open
+            self._bar = int(np.searchsorted(self.resampled['start'], bar_start, side='left'))
+            self._bar_start = bar_start
+        
+        self._index = index
+
+    @property
+    def current(self) -> FormingBar:
+        return self._forming
+
+    @property
+    def closed(self) -> np.ndarray:
+        self._sync()
+        return self.resampled[:self._bar]
+
+    @property
+    def last_closed(self):
+        self._sync()
+        return self.resampled[self._bar - 1] if self._bar > 0 else None
+
+    def __len__(self) -> int:
+        self._sync()
+        return self._bar + 1
+
+    def __getitem__(self, key):
+        self._sync()
+        length = self._bar + 1
+        
+        if isinstance(key, slice):
+            # Same rules as CandleWindow: relative to the view, never including the forming bar
+            start, stop, step = key.indices(length)
+            if step > 0:
+                return self.resampled[start:max(start, min(stop, length - 1)):step]
+            return self.resampled[np.arange(min(start, length - 2), stop, step)]
+        
+        if key < 0:
+            key += length
+        if not 0 <= key < length:
+            raise IndexError("timeframe window index out of range")
+        if key == length - 1:
+            return self._forming
+        return self.resampled[key]
+
+    def __repr__(self) -> str:
+        return f"TimeframeWindow(timeframe_ms={self.timeframe_ms}, window={self.window})"
@@ -1,5 +1,8 @@
 class CollateralManager:
-    def __init__(self, initial_collateral):
+    # Whether other accounts share this collateral (see CrossCollateralManager)
+    is_cross = False
+    
+    def __init__(self, initial_collateral, check_invariants: bool = True):
         self.balance = initial_collateral
         self.total_collateral = initial_collateral
         self.free_collateral = initial_collateral
@@ -8,6 +11,10 @@ class CollateralManager:
 
         self.account_health = 1.0 # 1.0 == perfect health, 0.0 == liquidated
         self.min_account_health = 1.0
+        self.liquidations = 0
+        
+        # Asserting the health bounds on every update is expensive in long runs, without it validate() checks them once at the end
+        self.check_invariants = check_invariants
     
     def has_sufficient_margin_to_open_order(self, required_margin: float) -> bool:
         return required_margin <= self.free_collateral
@@ -15,6 +22,14 @@ class CollateralManager:
     def add_realized_pnl(self, realized_pnl: float):
         self.balance += realized_pnl
 
+    def is_settled(self) -> bool:
+        # Nothing left to account for once flat: the last update already reflects the balance
+        return self.total_collateral == self.balance
+
+    def external_equity(self) -> float:
+        # Unrealized pnl minus maintenance margin held by other accounts sharing this collateral
+        return 0
+
     def update(self, open_orders_maintenance_margin, position_maintenance_margin, position_unrealized_pnl,):
         
         self.maintenance_margin = position_maintenance_margin + open_orders_maintenance_margin
@@ -29,10 +44,23 @@ class CollateralManager:
         else:
             self.account_health = 1 - (self.maintenance_margin / self.total_collateral)
 
-        assert 0 <= self.account_health <= 1.0, f"Account health out of bounds: {self.account_health}, {self.maintenance_margin}/{self.total_collateral}"
+        if self.check_invariants:
+            assert 0 <= self.account_health <= 1.0, f"Account health out of bounds: {self.account_health}, {self.maintenance_margin}/{self.total_collateral}"
 
         self.min_account_health = min(self.min_account_health, self.account_health)
 
+    def liquidate(self):
+        # Called once the position is closed and orders are cancelled, whatever balance is left stays with the account
+        self.maintenance_margin = 0
+        self.total_collateral = self.balance
+        self.free_collateral = self.balance
+        self.account_health = 0
+        self.min_account_health = 0
+        self.liquidations += 1
+
+    def validate(self):
+        assert 0 <= self.min_account_health <= self.account_health <= 1.0, f"Account health out of bounds: {self.account_health} (lowest {self.min_account_health}), {self.maintenance_margin}/{self.total_collateral}"
+
     def get_lowest_account_health(self):
         return self.min_account_health
     
@@ -40,4 +68,134 @@ class CollateralManager:
         return (f"CollateralManager(total_collateral={self.total_collateral}, "
                 f"free margin={self.free_collateral}, "
                 f"account_health={self.account_health}, "
-                f"lowest_health={self.min_account_health})")
\ No newline at end of file
+                f"lowest_health={self.min_account_health})")
+
+'''
+Cross-margin collateral shared by every account of a PortfolioAccount. Each account talks to it through its own CrossMarginLeg,
+which remembers what that account last contributed so the totals are adjusted by the accounts that changed instead of summing
+over every symbol.
+'''
+class CrossCollateralManager(CollateralManager):
+    def __init__(self, initial_collateral, check_invariants: bool = True):
+        super().__init__(initial_collateral, check_invariants)
+        self.unrealized_pnl = 0
+        self.legs = {}
+        self.health_stale = False # Realized pnl was added since health was last calculated
+        self.on_liquidation = None # Called with the symbol that got liquidated, so the other accounts can be closed
+        self._open_legs = 0 # Legs contributing margin or pnl
+
+    def leg(self, symbol) -> 'CrossMarginLeg':
+        leg = CrossMarginLeg(self, symbol)
+        self.legs[symbol] = leg
+        return leg
+
+    def add_realized_pnl(self, realized_pnl: float):
+        self.balance += realized_pnl
+        self.health_stale = True
+
+    def update_leg(self, leg: 'CrossMarginLeg', open_orders_maintenance_margin, position_maintenance_margin, position_unrealized_pnl):
+        maintenance_margin = position_maintenance_margin + open_orders_maintenance_margin
+        was_open = leg.maintenance_margin != 0 or leg.unrealized_pnl != 0
+        is_open = maintenance_margin != 0 or position_unrealized_pnl != 0
+        self._open_legs += int(is_open) - int(was_open)
+
+        if self._open_legs == 0:
+            # Reset rather than subtract so rounding doesn't accumulate across positions
+            self.maintenance_margin = 0
+            self.unrealized_pnl = 0
+        elif self._open_legs == 1 and is_open:
+            self.maintenance_margin = maintenance_margin
+            self.unrealized_pnl = position_unrealized_pnl
+        else:
+            self.maintenance_margin += maintenance_margin - leg.maintenance_margin
+            self.unrealized_pnl += position_unrealized_pnl - leg.unrealized_pnl
+        leg.maintenance_margin = maintenance_margin
+        leg.unrealized_pnl = position_unrealized_pnl
+
+        self.total_collateral = self.balance + self.unrealized_pnl
+        self.free_collateral = self.balance - self.maintenance_margin
+        self.health_stale = False
+        self._calculate_account_health()
+
+    def liquidate_leg(self, leg: 'CrossMarginLeg'):
+        # Cross margin liquidates the whole portfolio, not just the symbol that crossed its liquidation price
+        if self.on_liquidation is not None:
+            self.on_liquidation(leg.symbol)
+        for other in self.legs.values():
+            other.maintenance_margin = 0
+            other.unrealized_pnl = 0
+        self._open_legs = 0
+        self.unrealized_pnl = 0
+        self.health_stale = False
+        self.liquidate()
+
+    def __repr__(self):
+        return (f"CrossCollateralManager(symbols={len(self.legs)}, total_collateral={self.total_collateral}, "
+                f"free margin={self.free_collateral}, "
+                f"account_health={self.account_health}, "
+                f"lowest_health={self.min_account_health})")
+
+'''
+One account's view of a CrossCollateralManager. It has the CollateralManager interface Account uses, with balances and health
+read from the shared manager, and keeps the margin and unrealized pnl this account contributed.
+'''
+class CrossMarginLeg:
+    __slots__ = ('shared', 'symbol', 'maintenance_margin', 'unrealized_pnl')
+    is_cross = True
+
+    def __init__(self, shared: CrossCollateralManager, symbol):
+        self.shared = shared
+        self.symbol = symbol
+        self.maintenance_margin = 0
+        self.unrealized_pnl = 0
+
+    @property
+    def balance(self):
+        return self.shared.balance
+
+    @property
+    def total_collateral(self):
+        return self.shared.total_collateral
+
+    @property
+    def free_collateral(self):
+        return self.shared.free_collateral
+
+    @property
+    def account_health(self):
+        return self.shared.account_health
+
+    @property
+    def min_account_health(self):
+        return self.shared.min_account_health
+
+    @property
+    def check_invariants(self):
+        return self.shared.check_invariants
+
+    def has_sufficient_margin_to_open_order(self, required_margin: float) -> bool:
+        return self.shared.has_sufficient_margin_to_open_order(required_margin)
+
+    def add_realized_pnl(self, realized_pnl: float):
+        self.shared.add_realized_pnl(realized_pnl)
+
+    def is_settled(self) -> bool:
+        return self.maintenance_margin == 0 and self.unrealized_pnl == 0 and not self.shared.health_stale
+
+    def external_equity(self) -> float:
+        return (self.shared.unrealized_pnl - self.unrealized_pnl) - (self.shared.maintenance_margin - self.maintenance_margin)
+
+    def update(self, open_orders_maintenance_margin, position_maintenance_margin, position_unrealized_pnl):
+        self.shared.update_leg(self, open_orders_maintenance_margin, position_maintenance_margin, position_unrealized_pnl)
+
+    def liquidate(self):
+        self.shared.liquidate_leg(self)
+
+    def validate(self):
+        self.shared.validate()
+
+    def get_lowest_account_health(self):
+        return self.shared.min_account_health
+
+    def __repr__(self):
+        return f"CrossMarginLeg(symbol={self.symbol}, maintenance_margin={self.maintenance_margin}, unrealized_pnl={self.unrealized_pnl}, shared={self.shared})"
@@ -0,0 +1,98 @@
+from typing import List, Optional, Tuple
+import json
+import numpy as np
+from src.order import OrderDirection
+
+'''
+Trading costs charged by Account:
+- fees on the notional of every fill, maker_fee for resting limit orders and taker_fee for market entries, stops and exits
+  (negative maker fees are rebates)
+- slippage on fills that take liquidity, which fill `slippage` (a fraction of price) worse than their price
+- funding on open positions at every funding time, longs pay shorts rate * position notional at the mark price (shorts pay
+  when the rate is negative)
+
+funding_times (ms) and funding_rates come from a local series, e.g. load_funding_rates(). Payments are applied at the open of
+the first candle starting at or after each funding time, the simulations find those candles up front with funding_schedule().
+'''
+class CostModel:
+    def __init__(self, maker_fee: float = 0.0, taker_fee: float = 0.0, slippage: float = 0.0,
+                 funding_times: Optional[np.ndarray] = None, funding_rates: Optional[np.ndarray] = None):
+        if slippage < 0:
+            raise ValueError(f"Slippage must be non-negative, got {slippage}")
+        if taker_fee < 0:
+            raise ValueError(f"Taker fee must be non-negative, got {taker_fee}") # Only maker fees can be rebates
+        if (funding_times is None) != (funding_rates is None):
+            raise ValueError("funding_times and funding_rates must be given together")
+
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.slippage = slippage
+        self.funding_times = None
+        self.funding_rates = None
+
+        if funding_times is not None:
+            self.funding_times = np.asarray(funding_times, dtype=np.int64)
+            self.funding_rates = np.asarray(funding_rates, dtype=np.float64)
+            if self.funding_times.shape != self.funding_rates.shape:
+                raise ValueError("funding_times and funding_rates must have the same length")
+            if np.any(np.diff(self.funding_times) <= 0):
+                raise ValueError("funding_times must be strictly increasing")
+
+    def fee(self, notional: float, taker: bool) -> float:
+        return notional * (self.taker_fee if taker else self.maker_fee)
+
+    def slipped_price(self, price: float, direction: OrderDirection) -> float:
+        # Buys fill higher and sells lower
+        return price * (1 + self.slippage * direction)
+
+    def funding_schedule(self, candle_starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # (candle index, rate) of every funding payment falling inside the candles
+        if self.funding_times is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        indices = np.searchsorted(candle_starts, self.funding_times, side='left')
+        inside = (indices < len(candle_starts)) & (self.funding_times >= (candle_starts[0] if len(candle_starts) else 0))
+        return indices[inside], self.funding_rates[inside]
+
+    def __repr__(self) -> str:
+        funding = 0 if self.funding_times is None else len(self.funding_times)
+        return f"CostModel(maker_fee={self.maker_fee}, taker_fee={self.taker_fee}, slippage={self.slippage}, funding_times={funding})"
+
+'''
+Funding payments of one or more accounts over a run, in candle order. Simulation loops keep next_index in a local and only
+call apply() when the candle index reaches it, so runs without funding (or between funding times) pay one comparison per candle.
+'''
+class FundingSchedule:
+    def __init__(self, accounts: List, candle_starts: np.ndarray, first_candle: int = 0):
+        events = []
+        for account in accounts:
+            if account.cost_model is not None:
+                indices, rates = account.cost_model.funding_schedule(candle_starts)
+                keep = indices >= first_candle
+                events += zip(indices[keep].tolist(), [account] * int(np.count_nonzero(keep)), rates[keep].tolist())
+        events.sort(key=lambda event: event[0])
+
+        self.events = events
+        self.position = 0
+        self.next_index = events[0][0] if events else -1
+
+    def apply(self, candle_index: int, mark_price: float) -> int:
+        # Pays every funding due at candle_index and returns the candle index of the next payment (-1 when there is none)
+        events = self.events
+        while self.position < len(events) and events[self.position][0] == candle_index:
+            _, account, rate = events[self.position]
+            account.apply_funding(rate, mark_price)
+            self.position += 1
+
+        self.next_index = events[self.position][0] if self.position < len(events) else -1
+        return self.next_index
+
+def load_funding_rates(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    # Reads a json list of {"fundingTime": ms, "fundingRate": rate} (the exchange's funding history format), sorted by time
+    with open(path) as f:
+        rows = json.load(f)
+
+    times = np.array([int(row['fundingTime']) for row in rows], dtype=np.int64)
+    rates = np.array([float(row['fundingRate']) for row in rows], dtype=np.float64)
+    order = np.argsort(times, kind='stable')
+    return times[order], rates[order]
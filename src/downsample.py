@@ -0,0 +1,63 @@
+import numpy as np
+
+# Above this many input points per output point, LTTB runs on min/max preselected points instead of all of them
+MINMAX_RATIO = 4
+
+def minmax_indices(y: np.ndarray, n_buckets: int) -> np.ndarray:
+    # Indices of the minimum and maximum of y in each of n_buckets equal buckets, sorted. Keeps every spike, fully vectorized.
+    n = len(y)
+    if n_buckets <= 0 or 2 * n_buckets >= n:
+        return np.arange(n)
+
+    bucket_size = -(-n // n_buckets)
+    padded = np.pad(np.asarray(y, dtype=np.float64), (0, n_buckets * bucket_size - n), mode='edge').reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets) * bucket_size
+    indices = np.concatenate((offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)))
+    return np.unique(np.minimum(indices, n - 1))
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from each of n_out - 2 buckets, the point forming the
+    # largest triangle with the previously kept point and the average of the next bucket. Returns sorted indices into x and y.
+    n = len(y)
+    if n_out < 3:
+        raise ValueError("LTTB needs at least 3 output points")
+    if n_out >= n:
+        return np.arange(n)
+
+    if n > MINMAX_RATIO * n_out:
+        # MinMaxLTTB: the preselection keeps the extremes LTTB would pick while cutting its work to a few points per bucket
+        candidates = minmax_indices(y, MINMAX_RATIO * n_out // 2)
+        candidates = np.union1d(candidates, (0, n - 1))
+        return candidates[lttb_indices(x[candidates], y[candidates], n_out)]
+
+    x = np.asarray(x, dtype=np.float64) - x[0]
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket i spans [edges[i], edges[i + 1]), the first and last points are buckets of their own
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    x_sums = np.add.reduceat(x[:n - 1], edges[:-1])
+    y_sums = np.add.reduceat(y[:n - 1], edges[:-1])
+    next_x = np.append(x_sums[1:] / counts[1:], x[-1])
+    next_y = np.append(y_sums[1:] / counts[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        areas = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(areas.argmax())
+        selected[i + 1] = a
+    return selected
+
+def bucket_first_indices(x: np.ndarray, groups: np.ndarray, n_buckets: int) -> np.ndarray:
+    # Thins out markers: keeps the first point of each group (e.g. trade direction) in each of n_buckets equal spans of x
+    if len(x) <= n_buckets:
+        return np.arange(len(x))
+
+    span = max(float(x[-1] - x[0]), 1.0)
+    buckets = np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    _, first = np.unique(buckets * (int(groups.max()) - int(groups.min()) + 1) + (groups - groups.min()), return_index=True)
+    return np.sort(first)
@@ -0,0 +1,66 @@
+from typing import List, Optional
+import numpy as np
+from src.candle_manager import find_candle_range
+from src.order import OrderDirection
+
+PATHS = ('nearest', 'high_first', 'low_first', 'pessimistic')
+
+'''
+Decides the order in which prices were visited inside a candle, which decides the order resting orders fill in.
+
+Without finer data a candle is assumed to move open -> one extreme -> the other extreme -> close:
+- 'nearest' visits whichever extreme is closer to the open first (high on ties)
+- 'high_first' / 'low_first' always visit that extreme first
+- 'pessimistic' visits the extreme that hurts the open position first, so stop losses fill before take profits
+
+If sub_candles (e.g. 1m candles under 1h candles) are given, the path is the concatenation of the paths of the sub-candles
+inside [start, start + timeframe_ms), each one following the assumption above. Candles without sub-candles fall back to the assumption.
+'''
+class FillModel:
+    def __init__(self, path: str = 'nearest', sub_candles: Optional[np.ndarray] = None, timeframe_ms: Optional[int] = None, sub_day_index: Optional[np.ndarray] = None):
+        if path not in PATHS:
+            raise ValueError(f"Unknown fill path '{path}', expected one of {PATHS}")
+        if sub_candles is not None and not timeframe_ms:
+            raise ValueError("timeframe_ms is required to find the sub-candles of a candle")
+
+        self.path = path
+        self.sub_candles = sub_candles
+        self.timeframe_ms = timeframe_ms
+        self.sub_day_index = sub_day_index
+
+    def price_path(self, open_price: float, high: float, low: float, close: float, start: Optional[int] = None, position_direction: Optional[OrderDirection] = None) -> List[float]:
+        if self.sub_candles is not None and start is not None:
+            start_index, end_index = find_candle_range(self.sub_candles, start, start + self.timeframe_ms, self.sub_day_index)
+            if end_index > start_index:
+                return self._sub_candle_path(self.sub_candles[start_index:end_index], position_direction)
+
+        return self._ohlc_path(open_price, high, low, close, position_direction)
+
+    def _sub_candle_path(self, sub_candles: np.ndarray, position_direction: Optional[OrderDirection]) -> List[float]:
+        path = []
+        for candle in sub_candles.tolist():
+            _, open_price, high, low, close = candle
+            path += self._ohlc_path(open_price, high, low, close, position_direction)
+        return path
+
+    def _ohlc_path(self, open_price: float, high: float, low: float, close: float, position_direction: Optional[OrderDirection]) -> List[float]:
+        path = self.path
+        if path == 'pessimistic':
+            if position_direction == OrderDirection.LONG:
+                path = 'low_first'
+            elif position_direction == OrderDirection.SHORT:
+                path = 'high_first'
+            else:
+                path = 'nearest'
+
+        if path == 'nearest':
+            high_first = high - open_price <= open_price - low
+        else:
+            high_first = path == 'high_first'
+
+        if high_first:
+            return [open_price, high, low, close]
+        return [open_price, low, high, close]
+
+    def __repr__(self) -> str:
+        return f"FillModel(path={self.path}, sub_candles={None if self.sub_candles is None else len(self.sub_candles)})"
@@ -0,0 +1,383 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from math import sqrt, nan, isnan
+from typing import Dict, List, Optional
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+'''
+Technical indicators with two interchangeable modes:
+ - update(candle) feeds one closed candle and returns the new value in O(1).
+ - compute(candles) returns the whole series for a candle array, where series[i] is the value after update(candles[i]).
+
+Both modes run the same floating point operations in the same order so their values are identical, not just close.
+Rolling sums are therefore kept as a running cumulative sum minus the cumulative sum `period` candles ago, which is exactly
+what np.cumsum produces. Recursive indicators (EMA, RSI, ATR) have no vector form that keeps this guarantee,
+their compute() runs the recurrence over plain floats instead.
+Values are nan until the indicator has seen enough candles.
+'''
+class Indicator(ABC):
+    # Number of values per candle, indicators with more than one output return tuples/rows
+    outputs = 1
+
+    def __init__(self, period: int, source: str = 'close'):
+        if period < 1:
+            raise ValueError(f"Indicator period must be at least 1, got {period}")
+        self.period = period
+        self.source = source
+        self.value = nan
+
+    @abstractmethod
+    def update(self, candle):
+        """Feed the next closed candle and return the updated value."""
+
+    @abstractmethod
+    def compute(self, candles: np.ndarray) -> np.ndarray:
+        """Return the indicator series for every candle in candles."""
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(period={self.period}, source={self.source})"
+
+class _RollingSum:
+    # O(1) rolling sum of the last `period` values that matches _rolling_sums() bit for bit
+    __slots__ = ('period', 'count', 'cumulative', 'ring')
+
+    def __init__(self, period: int):
+        self.period = period
+        self.count = 0
+        self.cumulative = 0.0
+        self.ring = [0.0] * period
+
+    def push(self, x: float) -> float:
+        self.count += 1
+        slot = self.count % self.period
+        lagged = self.ring[slot]
+        self.cumulative += x
+        self.ring[slot] = self.cumulative
+        return self.cumulative - lagged if self.count >= self.period else nan
+
+def _rolling_sums(values: np.ndarray, period: int) -> np.ndarray:
+    cumulative = np.concatenate(([0.0], np.cumsum(values, dtype='f8')))
+    sums = np.full(len(values), nan)
+    if len(values) >= period:
+        sums[period - 1:] = cumulative[period:] - cumulative[:-period]
+    return sums
+
+class SMA(Indicator):
+    def __init__(self, period: int, source: str = 'close'):
+        super().__init__(period, source)
+        self._sum = _RollingSum(period)
+
+    def update(self, candle):
+        self.value = self._sum.push(float(candle[self.source])) / self.period
+        return self.value
+
+    def compute(self, candles: np.ndarray) -> np.ndarray:
+        return _rolling_sums(candles[self.source], self.period) / self.period
+
+class EMA(Indicator):
+    # Seeded with the simple average of the first `period` values
+    def __init__(self, period: int, source: str = 'close'):
+        super().__init__(period, source)
+        self.alpha = 2 / (period + 1)
+        self._count = 0
+        self._seed = 0.0
+
+    def update(self, candle):
+        return self._push(float(candle[self.source]))
+
+    def _push(self, x: float) -> float:
+        self._count += 1
+
+        if self._count < self.period:
+            self._seed += x
+        elif self._count == self.period:
+            self._seed += x
+            self.value = self._seed / self.period
+        else:
+            self.value = self.value + self.alpha * (x - self.value)
+        return self.value
+
+    def compute(self, candles: np.ndarray) -> np.ndarray:
+        return _replay(EMA(self.period, self.source)._push, candles[self.source])
+
+class RSI(Indicator):
+    # Wilder's RSI, the first value is available after period + 1 candles
+    def __init__(self, period: int = 14, source: str = 'close'):
+        super().__init__(period, source)
+        self._previous = None
+        self._count = 0
+        self._gain = 0.0
+        self._loss = 0.0
+
+    def update(self, candle):
+        return self._push(float(candle[self.source]))
+
+    def _push(self, x: float) -> float:
+        previous, self._previous = self._previous, x
+        if previous is None:
+            return self.value
+
+        change = x - previous
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+        self._count += 1
+
+        if self._count <= self.period:
+            self._gain += gain
+            self._loss += loss
+            if self._count < self.period:
+                return self.value
+            self._gain /= self.period
+            self._loss /= self.period
+        else:
+            self._gain = (self._gain * (self.period - 1) + gain) / self.period
+            self._loss = (self._loss * (self.period - 1) + loss) / self.period
+
+        self.value = 100.0 if self._loss == 0 else 100.0 - 100.0 / (1.0 + self._gain / self._loss)
+        return self.value
+
+    def compute(self, candles: np.ndarray) -> np.ndarray:
+        return _replay(RSI(self.period, self.source)._push, candles[self.source])
+
+class ATR(Indicator):
+    # Wilder's average true range, seeded with the simple average of the first `period` true ranges
+    def __init__(self, period: int = 14):
+        super().__init__(period, 'close')
+        self._previous_close = None
+        self._count = 0
+        self._seed = 0.0
+
+    def update(self, candle):
+        high = float(candle['high'])
+        low = float(candle['low'])
+        if self._previous_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - self._previous_close), abs(low - self._previous_close))
+        self._previous_close = float(candle['close'])
+
+        return self._smooth(true_range)
+
+    def _smooth(self, true_range: float) -> float:
+        self._count += 1
+        if self._count < self.period:
+            self._seed += true_range
+        elif self._count == self.period:
+            self._seed += true_range
+            self.value = self._seed / self.period
+        else:
+            self.value = (self.value * (self.period - 1) + true_range) / self.period
+        return self.value
+
+    def compute(self, candles: np.ndarray) -> np.ndarray:
+        high = candles['high'].astype('f8')
+        low = candles['low'].astype('f8')
+        previous_close = np.concatenate(([nan], candles['close'][:-1].astype('f8')))
+
+        true_range = high - low
+        if len(candles) > 1:
+            true_range[1:] = np.maximum(true_range[1:], np.maximum(np.abs(high[1:] - previous_close[1:]), np.abs(low[1:] - previous_close[1:])))
+
+        return _replay(ATR(self.period)._smooth, true_range)
+
+class Bollinger(Indicator):
+    # Value is (middle, upper, lower) using the population standard deviation over `period` candles
+    outputs = 3
+
+    def __init__(self, period: int = 20, deviations: float = 2.0, source: str = 'close'):
+        super().__init__(period, source)
+        self.deviations = deviations
+        self.value = (nan, nan, nan)
+        self._sum = _RollingSum(period)
+        self._sum_of_squares = _RollingSum(period)
+
+    def update(self, candle):
+        x = float(candle[self.source])
+        mean = self._sum.push(x) / self.period
+        mean_of_squares = self._sum_of_squares.push(x * x) / self.period
+        # Rounding can push the variance of a flat window slightly below zero
+        deviation = sqrt(max(mean_of_squares - mean * mean, 0.0)) if not isnan(mean) else nan
+
+        self.value = (mean, mean + self.deviations * deviation, mean - self.deviations * deviation)
+        return self.value
+
+    def compute(self, candles: np.ndarray) -> np.ndarray:
+        x = candles[self.source].astype('f8')
+        mean = _rolling_sums(x, self.period) / self.period
+        mean_of_squares = _rolling_sums(x * x, self.period) / self.period
+        deviation = np.sqrt(np.maximum(mean_of_squares - mean * mean, 0.0))
+
+        return np.column_stack((mean, mean + self.deviations * deviation, mean - self.deviations * deviation))
+
+class VWAP(Indicator):
+    # Rolling volume weighted typical price. Candles without a volume field weigh every candle equally.
+    def __init__(self, period: int):
+        super().__init__(period, 'close')
+        self._weighted = _RollingSum(period)
+        self._volume = _RollingSum(period)
+
+    def update(self, candle):
+        volume = float(candle['volume']) if 'volume' in candle.dtype.names else 1.0
+        typical_price = (float(candle['high']) + float(candle['low']) + float(candle['close'])) / 3
+
+        self.value = self._weighted.push(typical_price * volume) / self._volume.push(volume)
+        return self.value
+
+    def compute(self, candles: np.ndarray) -> np.ndarray:
+        volume = candles['volume'].astype('f8') if 'volume' in candles.dtype.names else np.ones(len(candles))
+        typical_price = (candles['high'].astype('f8') + candles['low'] + candles['close']) / 3
+
+        return _rolling_sums(typical_price * volume, self.period) / _rolling_sums(volume, self.period)
+
+class _RollingExtreme(Indicator):
+    # Monotonic deque of (candle number, value), amortised O(1) per update
+    def __init__(self, period: int, source: str):
+        super().__init__(period, source)
+        self._count = 0
+        self._window = deque()
+
+    @abstractmethod
+    def _dominates(self, a: float, b: float) -> bool:
+        """Whether a stays in the window ahead of a newer value b."""
+
+    def update(self, candle):
+        x = float(candle[self.source])
+        while self._window and not self._dominates(self._window[-1][1], x):
+            self._window.pop()
+        self._window.append((self._count, x))
+        if self._window[0][0] <= self._count - self.period:
+            self._window.popleft()
+
+        self._count += 1
+        self.value = self._window[0][1] if self._count >= self.period else nan
+        return self.value
+
+    @abstractmethod
+    def _reduce(self, windows: np.ndarray) -> np.ndarray:
+        """Return the extreme of each row of windows."""
+
+    def compute(self, candles: np.ndarray) -> np.ndarray:
+        series = np.full(len(candles), nan)
+        if len(candles) >= self.period:
+            series[self.period - 1:] = self._reduce(sliding_window_view(candles[self.source].astype('f8'), self.period))
+        return series
+
+class RollingMax(_RollingExtreme):
+    def __init__(self, period: int, source: str = 'high'):
+        super().__init__(period, source)
+
+    def _dominates(self, a: float, b: float) -> bool:
+        return a > b
+
+    def _reduce(self, windows: np.ndarray) -> np.ndarray:
+        return windows.max(axis=1)
+
+class RollingMin(_RollingExtreme):
+    def __init__(self, period: int, source: str = 'low'):
+        super().__init__(period, source)
+
+    def _dominates(self, a: float, b: float) -> bool:
+        return a < b
+
+    def _reduce(self, windows: np.ndarray) -> np.ndarray:
+        return windows.min(axis=1)
+
+def _replay(push, values: np.ndarray) -> np.ndarray:
+    # Runs a recurrence over plain python floats, much faster than feeding numpy records one at a time
+    return np.array([push(x) for x in values.astype('f8').tolist()], dtype='f8')
+
+class _Feed:
+    # One indicator and how far into a candle array it has been fed. Shared by every IndicatorSet that declares
+    # the same indicator with the same parameters, so it is only updated once per candle.
+    __slots__ = ('factory', 'indicator', 'candles', 'fed', 'series')
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.indicator = factory()
+        self.candles = None
+        self.fed = 0
+        self.series = None
+
+    def stream(self, candles: np.ndarray, index: int):
+        if self.candles is not candles:
+            if self.candles is not None:
+                self.indicator = self.factory()
+            self.candles = candles
+            self.fed = 0
+
+        # Every candle that closed since the last call, normally exactly one (more on the first call after warmup)
+        update = self.indicator.update
+        for i in range(self.fed, index):
+            update(candles[i])
+        self.fed = max(self.fed, index)
+
+    def precompute(self, candles: np.ndarray):
+        if self.candles is not candles:
+            self.candles = candles
+            self.series = self.indicator.compute(candles)
+
+'''
+Indicators declared by a strategy, the same way hyperparameters() declares parameters:
+    {'name': 'fast', 'type': EMA, 'period': 12, 'source': 'close'}
+Every key besides name and type is passed to the indicator's constructor.
+
+mode='stream' updates every indicator in O(1) as each candle closes.
+mode='precompute' computes every series once over the whole candle array and then only indexes into it.
+In both modes self[name] is the value after the last closed candle, the forming candle never contributes.
+
+Sets created with the same `shared` dict (e.g. strategies in one batch run) compute identical declarations only once.
+'''
+class IndicatorSet:
+    MODES = ('stream', 'precompute')
+
+    def __init__(self, declarations: List[Dict], mode: str = 'stream', shared: Optional[Dict] = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid indicator mode: {mode}")
+
+        self.mode = mode
+        shared = shared if shared is not None else {}
+
+        self._feeds: Dict[str, _Feed] = {}
+        for declaration in declarations:
+            indicator_type = declaration['type']
+            params = {key: value for key, value in declaration.items() if key not in ('name', 'type')}
+
+            key = (mode, indicator_type, tuple(sorted(params.items())))
+            if key not in shared:
+                shared[key] = _Feed(lambda indicator_type=indicator_type, params=params: indicator_type(**params))
+            self._feeds[declaration['name']] = shared[key]
+
+        self._index = 0
+
+    @property
+    def indicators(self) -> Dict[str, Indicator]:
+        return {name: feed.indicator for name, feed in self._feeds.items()}
+
+    def advance(self, window):
+        # Called once per candle with the strategy's CandleWindow, window.index is the forming candle
+        self._index = window.index
+
+        if self.mode == 'precompute':
+            for feed in self._feeds.values():
+                feed.precompute(window.candles)
+        else:
+            for feed in self._feeds.values():
+                feed.stream(window.candles, self._index)
+
+    def __getitem__(self, name: str):
+        feed = self._feeds[name]
+        if self.mode == 'stream':
+            return feed.indicator.value
+
+        series = feed.series
+        if self._index == 0:
+            return (nan,) * series.shape[1] if series.ndim > 1 else nan
+        value = series[self._index - 1]
+        return tuple(value.tolist()) if series.ndim > 1 else float(value)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._feeds
+
+    def __repr__(self) -> str:
+        return f"IndicatorSet(mode={self.mode}, indicators={list(self._feeds)})"
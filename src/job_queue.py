@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional
+import multiprocessing
+import threading
+import time
+import uuid
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+class Job:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.state = QUEUED
+        self.future = None
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+
+    def __repr__(self) -> str:
+        return f"Job(job_id={self.job_id}, state={self.state})"
+
+'''
+Runs jobs in a bounded pool of worker processes so long backtests don't block the caller and several can run at once.
+
+A job is fn(*args, report=report) for a picklable module level fn. It calls report(done, total, **values) every now and
+then to publish its progress, and should stop early when report returns True, which means the job was cancelled.
+Progress and cancel flags go through a multiprocessing manager, results come back through the pool. Workers are reused,
+so anything fn caches at module level (strategy classes, memory-mapped candles) is only loaded once per worker.
+'''
+class JobQueue:
+    def __init__(self, max_workers: Optional[int] = None, max_jobs: int = 100):
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.max_jobs = max_jobs # Finished jobs beyond this many are forgotten, oldest first
+        self.jobs: Dict[str, Job] = OrderedDict()
+        self._lock = threading.Lock()
+        # Started on the first submit so importing a module that owns a queue doesn't spawn processes
+        self._executor = None
+        self._manager = None
+        self._progress = None
+        self._cancelled = None
+
+    def submit(self, fn: Callable, *args, on_done: Optional[Callable] = None) -> str:
+        # on_done(result) is called in this process once the job finishes without failing or being cancelled
+        with self._lock:
+            if self._executor is None:
+                self._manager = multiprocessing.Manager()
+                self._progress = self._manager.dict()
+                self._cancelled = self._manager.dict()
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+            job = self._add_job()
+            job.future = self._executor.submit(_run_job, job.job_id, self._progress, self._cancelled, fn, *args)
+        job.future.add_done_callback(lambda future: self._finish(job, future, on_done))
+        return job.job_id
+
+    def add_result(self, result) -> str:
+        # Registers an already known result (e.g. from a cache) as a finished job
+        with self._lock:
+            job = self._add_job()
+            job.state = DONE
+            job.result = result
+        return job.job_id
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job.state in FINISHED_STATES:
+            return False
+        if not job.future.cancel():
+            self._cancelled[job_id] = True # Already running, the job stops at its next report
+        return True
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        status = {'job_id': job_id, 'state': job.state, 'error': job.error}
+        if job.state not in FINISHED_STATES:
+            progress = self._progress.get(job_id)
+            if progress is not None:
+                status['state'] = RUNNING
+                status.update(progress)
+        return status
+
+    def result(self, job_id: str):
+        job = self.jobs.get(job_id)
+        return job.result if job is not None and job.state == DONE else None
+
+    def shutdown(self):
+        if self._executor is not None:
+            for job in list(self.jobs.values()):
+                self.cancel(job.job_id)
+            self._executor.shutdown(wait=True)
+            self._manager.shutdown()
+            self._executor = None
+
+    def _add_job(self) -> Job:
+        job = Job(uuid.uuid4().hex)
+        self.jobs[job.job_id] = job
+
+        finished = [old.job_id for old in self.jobs.values() if old.state in FINISHED_STATES]
+        for old_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[old_id]
+        return job
+
+    def _finish(self, job: Job, future, on_done: Optional[Callable]):
+        if future.cancelled():
+            job.state = CANCELLED
+        elif future.exception() is not None:
+            job.state = FAILED
+            job.error = repr(future.exception())
+        else:
+            cancelled, result = future.result()
+            if cancelled:
+                job.state = CANCELLED
+            else:
+                job.result = result
+                job.state = DONE
+                if on_done is not None:
+                    on_done(result)
+
+        if self._progress is not None:
+            self._progress.pop(job.job_id, None)
+            self._cancelled.pop(job.job_id, None)
+
+    def __repr__(self) -> str:
+        states = [job.state for job in self.jobs.values()]
+        return f"JobQueue(max_workers={self.max_workers}, jobs={len(states)}, pending={states.count(QUEUED)})"
+
+def _run_job(job_id, progress, cancelled, fn, *args):
+    # Runs in a worker process, returns (whether the job was cancelled, result)
+    def report(done, total, **values):
+        progress[job_id] = {'done': done, 'total': total, **values}
+        return job_id in cancelled
+
+    if report(0, None): # Cancelled while waiting in the pool's call queue
+        return True, None
+    result = fn(*args, report=report)
+    return job_id in cancelled, result
@@ -1,5 +1,71 @@
+from array import array
+import numpy as np
 from src.order import BaseOrder, OrderDirection
 
+FILL_DTYPE = np.dtype([
+    ('candle_index', 'i8'),
+    ('uid', 'i8'),
+    ('direction', 'i1'),
+    ('price', 'f8'),
+    ('size', 'f8'),
+    ('realized_pnl', 'f8'),
+    ('position', 'f8'),  # Signed position size after the fill
+    ('fee', 'f8')
+])
+
+MINUTES_PER_YEAR = 365 * 24 * 60
+
+# Everything performance_metrics() returns and whether higher is better, for optimizer targets
+PERFORMANCE_METRICS = {
+    'total_return': 'maximize',
+    'sharpe': 'maximize',
+    'sortino': 'maximize',
+    'max_drawdown': 'minimize',
+    'max_drawdown_duration': 'minimize',
+    'trades': 'maximize',
+    'win_rate': 'maximize',
+    'profit_factor': 'maximize',
+    'exposure': 'maximize',
+    'average_trade_duration': 'minimize',
+    'turnover': 'maximize',
+}
+
+'''
+Columnar log of filled orders. Each field is a typed array, so a fill costs a few machine words instead of
+keeping its order object alive for the rest of the run.
+'''
+class FillLog:
+    __slots__ = ('candle_index', 'uid', 'direction', 'price', 'size', 'realized_pnl', 'position', 'fee')
+
+    def __init__(self):
+        self.candle_index = array('q')
+        self.uid = array('q')
+        self.direction = array('b')
+        self.price = array('d')
+        self.size = array('d')
+        self.realized_pnl = array('d')
+        self.position = array('d')
+        self.fee = array('d')
+
+    def append(self, order: BaseOrder, candle_index: int, realized_pnl: float = 0.0, position: float = 0.0, fee: float = 0.0):
+        self.candle_index.append(candle_index)
+        self.uid.append(order.uid)
+        self.direction.append(order.direction)
+        self.price.append(order.price)
+        self.size.append(order.size)
+        self.realized_pnl.append(realized_pnl)
+        self.position.append(position)
+        self.fee.append(fee)
+
+    def to_numpy(self) -> np.ndarray:
+        fills = np.empty(len(self), dtype=FILL_DTYPE)
+        for name in FILL_DTYPE.names:
+            fills[name] = np.frombuffer(getattr(self, name), dtype=FILL_DTYPE[name])
+        return fills
+
+    def __len__(self):
+        return len(self.uid)
+
 class Metrics:
     def __init__(self, starting_balance):
         
@@ -10,8 +76,12 @@ class Metrics:
         self.total_shorts = 0
         
         self.total_fees = 0
+        self.total_funding = 0 # Funding received, negative when paid
         
-        self.order_history = []
+        self.order_history = FillLog() # Orders the strategy opened
+        self.fills = FillLog() # Every fill on the account (entries, take profits, stops, exits), with realized pnl
+        self.liquidations = [] # (candle index, liquidation price)
+        self.equity = [] # Total collateral after each candle, set by the simulation
         
         self.current_candle_index = -1
     
@@ -30,4 +100,74 @@ class Metrics:
         else:
             self.total_shorts += 1
         
-        self.order_history.append((order, self.current_candle_index))
\ No newline at end of file
+        self.order_history.append(order, self.current_candle_index)
+
+    def new_fill(self, order: BaseOrder, realized_pnl: float, position: float, fee: float):
+        self.fills.append(order, self.current_candle_index, realized_pnl, position, fee)
+        self.total_fees += fee
+
+    def new_funding(self, payment: float):
+        self.total_funding += payment
+
+    def new_liquidation(self, price: float):
+        self.liquidations.append((self.current_candle_index, price))
+
+    def performance(self, periods_per_year: float = MINUTES_PER_YEAR) -> dict:
+        return performance_metrics(self.equity, self.fills.to_numpy(), self.starting_balance, periods_per_year)
+
+def performance_metrics(equity, fills: np.ndarray, starting_balance: float, periods_per_year: float = MINUTES_PER_YEAR) -> dict:
+    # One vectorized pass over the equity curve (one value per candle) and the fill log. periods_per_year is the
+    # number of candles in a year, used to annualize sharpe and sortino. Durations are in candles, drawdowns and
+    # exposure are fractions, turnover is traded notional over the average equity.
+    equity = np.asarray(equity, dtype=np.float64)
+    n = len(equity)
+    metrics = dict.fromkeys(PERFORMANCE_METRICS, 0.0)
+    if n == 0:
+        return metrics
+    
+    curve = np.concatenate(([starting_balance], equity))
+    metrics['total_return'] = equity[-1] / starting_balance - 1
+    
+    previous = curve[:-1]
+    returns = np.divide(np.diff(curve), previous, out=np.zeros(n), where=previous > 0)
+    mean = returns.mean()
+    deviation = returns.std()
+    downside_deviation = np.sqrt(np.mean(np.minimum(returns, 0) ** 2))
+    annualization = np.sqrt(periods_per_year)
+    metrics['sharpe'] = mean / deviation * annualization if deviation > 0 else 0.0
+    metrics['sortino'] = mean / downside_deviation * annualization if downside_deviation > 0 else 0.0
+    
+    peaks = np.maximum.accumulate(curve)
+    drawdowns = np.divide(peaks - curve, peaks, out=np.zeros(n + 1), where=peaks > 0)
+    metrics['max_drawdown'] = drawdowns.max()
+    # Longest stretch of candles spent below the previous peak
+    at_peak = np.flatnonzero(curve >= peaks)
+    metrics['max_drawdown_duration'] = int(np.diff(np.append(at_peak, n + 1)).max() - 1)
+    
+    if len(fills):
+        # A trade runs from the fill that takes the position away from flat to the one that returns it to flat or flips it
+        position = fills['position']
+        previous_position = np.concatenate(([0.0], position[:-1]))
+        flipped = np.sign(position) != np.sign(previous_position)
+        opens = np.flatnonzero((position != 0) & ((previous_position == 0) | flipped))
+        closes = np.flatnonzero((previous_position != 0) & ((position == 0) | flipped))
+        
+        # Realized pnl only comes from fills reducing the open trade, so a trade's pnl is the pnl realized (net of the fees
+        # paid opening and closing it) since the previous close
+        realized = np.cumsum(fills['realized_pnl'] - fills['fee'])[closes]
+        trade_pnl = np.diff(realized, prepend=0.0)
+        wins = trade_pnl[trade_pnl > 0].sum()
+        losses = -trade_pnl[trade_pnl < 0].sum()
+        
+        candle_index = fills['candle_index']
+        durations = candle_index[closes] - candle_index[opens[:len(closes)]]
+        held = durations.sum() + (n - candle_index[opens[-1]] if len(opens) > len(closes) else 0)
+        
+        metrics['trades'] = len(closes)
+        metrics['win_rate'] = np.count_nonzero(trade_pnl > 0) / len(closes) if len(closes) else 0.0
+        metrics['profit_factor'] = wins / losses if losses > 0 else (np.inf if wins > 0 else 0.0)
+        metrics['exposure'] = held / n
+        metrics['average_trade_duration'] = durations.mean() if len(durations) else 0.0
+        metrics['turnover'] = np.sum(fills['price'] * fills['size']) / curve.mean()
+    
+    return {name: value if isinstance(value, int) else float(value) for name, value in metrics.items()}
@@ -1,9 +1,11 @@
-from enum import Enum
+from enum import Enum, IntEnum
+from itertools import count
 from typing import Optional
 
-class OrderDirection(Enum):
-    SHORT = "SHORT"
-    LONG = "LONG"
+class OrderDirection(IntEnum):
+    # Stored as small signed ints so columnar logs can keep them in int8 arrays, and so the value is the pnl sign
+    SHORT = -1
+    LONG = 1
 
     def opposite(self):
         return OrderDirection.LONG if self == OrderDirection.SHORT else OrderDirection.SHORT
@@ -11,9 +13,9 @@ class OrderDirection(Enum):
     @classmethod
     def from_string(cls, direction_str: str):
         direction_str = direction_str.upper()
-        if direction_str == cls.LONG.value:
+        if direction_str == cls.LONG.name:
             return cls.LONG
-        elif direction_str == cls.SHORT.value:
+        elif direction_str == cls.SHORT.name:
             return cls.SHORT
         else:
             raise ValueError(f"Invalid direction: {direction_str}")
@@ -31,33 +33,47 @@ class OrderStatus(Enum):
 class OrderType(Enum):
     LIMIT = "LIMIT"
     MARKET = "MARKET"
+    STOP_MARKET = "STOP_MARKET"  # price is the trigger, fills at the trigger (or the open if price gapped through it)
+    STOP_LIMIT = "STOP_LIMIT"  # price is the trigger, once triggered it becomes a limit order at limit_price
     
 class BaseOrder:
-    _id_counter = 0
+    # Strategies can create millions of orders, slots keep each one small and cheap to allocate
+    __slots__ = ('direction', 'size', 'price', 'order_status', 'uid', 'order_type', 'limit_price', 'linked_uid')
+    _id_counter = count(1)
 
-    def __init__(self, direction: OrderDirection, size: float, price: float, order_status : OrderStatus = OrderStatus.NEW, uid: Optional[int] = None):
+    def __init__(self, direction: OrderDirection, size: float, price: float, order_status : OrderStatus = OrderStatus.NEW, uid: Optional[int] = None,
+                 order_type: OrderType = OrderType.LIMIT, limit_price: Optional[float] = None):
         self.direction = direction
         self.size = size
         self.price = price
         self.order_status = order_status
-        self.uid = uid or self._generate_id()
+        self.uid = uid if uid is not None else self._generate_id()
+        self.order_type = order_type
+        self.limit_price = limit_price
+        # One-cancels-other: uid of an order that is cancelled when this one fills (e.g. a bracket's take profit and stop loss)
+        self.linked_uid: Optional[int] = None
+
+    @property
+    def is_stop(self) -> bool:
+        return self.order_type == OrderType.STOP_MARKET or self.order_type == OrderType.STOP_LIMIT
 
     @classmethod
     def _generate_id(cls) -> int:
-        cls._id_counter += 1
-        return cls._id_counter
+        return next(cls._id_counter)
 
     def __eq__(self, other) -> bool:
         # Two ways to define equality: UID is the same. Or, orders are considered fungible so properties can be checked for equality
         return self.direction == other.direction and self.size == other.size and self.price == other.price
 
     def __repr__(self) -> str:
-        return (f"{self.__class__.__name__}(uid={self.uid}, direction={self.direction.value}, size={self.size}, price={self.price}, status={self.order_status.value})")
+        return (f"{self.__class__.__name__}(uid={self.uid}, direction={self.direction.name}, size={self.size}, price={self.price}, status={self.order_status.value})")
 
     def __str__(self) -> str:
-        return f"Order(uid={self.uid}, direction={self.direction.value}, size={self.size}, price={self.price}, status={self.order_status.value})"
+        return f"Order(uid={self.uid}, direction={self.direction.name}, size={self.size}, price={self.price}, status={self.order_status.value})"
     
 class BracketOrder:
+    __slots__ = ('entry_order', 'entry_price', 'direction', 'size', 'take_profit_price', 'stop_loss_price')
+
     def __init__(self, entry_order: BaseOrder, take_profit_price = None, stop_loss_price = None):
         self.entry_order = entry_order
         self.entry_price = entry_order.price
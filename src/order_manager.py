@@ -1,5 +1,9 @@
+from bisect import bisect_left, bisect_right, insort
+import math
 from src.order import BaseOrder, OrderDirection
-from bintrees import FastRBTree
+
+# Returned for candles that trigger nothing, so the common case doesn't allocate
+_NO_ORDERS = ()
 
 class OrderManager:
 
@@ -7,43 +11,89 @@ class OrderManager:
         self.symbol = symbol
         self.long_orders = OrderGroup()
         self.short_orders = OrderGroup()
+        # Stop orders trigger in the opposite direction to limits: long stops when price rises to them, short stops when it falls
+        self.long_stops = OrderGroup()
+        self.short_stops = OrderGroup()
         self.orders = {}
+        self.dirty = True  # Set on every change, cleared by the account once it has recomputed the order margin
 
     def add_order(self, order: BaseOrder):
         if order.uid in self.orders:
             raise ValueError(f"Order with UID {order.uid} already exists.")
         
+        self.dirty = True
         self.orders[order.uid] = order
-        order_group = self.long_orders if order.direction == OrderDirection.LONG else self.short_orders
-        order_group.add_order(order)
+        self._order_group(order).add_order(order)
             
     def remove_order(self, order: BaseOrder):
         if order.uid not in self.orders:
             raise ValueError(f"Order {order.uid} not found.")
         
-        order_group = self.long_orders if order.direction == OrderDirection.LONG else self.short_orders
-        order_group.remove_order(order)
+        self.dirty = True
+        self._order_group(order).remove_order(order)
         del self.orders[order.uid]
 
+    def _order_group(self, order: BaseOrder):
+        if order.is_stop:
+            return self.long_stops if order.direction == OrderDirection.LONG else self.short_stops
+        return self.long_orders if order.direction == OrderDirection.LONG else self.short_orders
+
     def get_triggered_orders(self, low_price: float, high_price: float):
-        triggered_orders = []
+        # Long (buy) limits trigger at or above the low, short (sell) limits at or below the high.
+        # Long stops trigger at or below the high, short stops at or above the low.
+        long_triggered = self.long_orders.prices and low_price <= self.long_orders.prices[-1]
+        short_triggered = self.short_orders.prices and high_price >= self.short_orders.prices[0]
+        long_stops_triggered = self.long_stops.prices and high_price >= self.long_stops.prices[0]
+        short_stops_triggered = self.short_stops.prices and low_price <= self.short_stops.prices[-1]
         
-        if not self.long_orders.price_tree.is_empty():
-            max_long_price = self.long_orders.price_tree.max_key()
-            if low_price <= max_long_price:
-                triggered_orders.extend(self.long_orders.get_orders_in_price_range(low_price, max_long_price))
-            
-        if not self.short_orders.price_tree.is_empty():
-            min_short_price = self.short_orders.price_tree.min_key()
-            if high_price >= min_short_price:
-                triggered_orders.extend(self.short_orders.get_orders_in_price_range(min_short_price, high_price))
+        if not (long_triggered or short_triggered or long_stops_triggered or short_stops_triggered):
+            return _NO_ORDERS
+        
+        triggered_orders = []
+        if long_triggered:
+            self.long_orders.collect_orders_in_price_range(low_price, self.long_orders.prices[-1], triggered_orders)
+        if short_triggered:
+            self.short_orders.collect_orders_in_price_range(self.short_orders.prices[0], high_price, triggered_orders)
+        if long_stops_triggered:
+            self.long_stops.collect_orders_in_price_range(self.long_stops.prices[0], high_price, triggered_orders)
+        if short_stops_triggered:
+            self.short_stops.collect_orders_in_price_range(low_price, self.short_stops.prices[-1], triggered_orders)
         
         return triggered_orders
+
+    def get_orders_crossed_by(self, from_price: float, to_price: float):
+        # Orders triggered as price moves from from_price to to_price, in the order price reaches them
+        orders = []
+        if to_price >= from_price:
+            self.short_orders.collect_orders_in_price_range(from_price, to_price, orders)
+            self.long_stops.collect_orders_in_price_range(from_price, to_price, orders)
+            orders.sort(key=_order_price)
+        else:
+            self.long_orders.collect_orders_in_price_range(to_price, from_price, orders)
+            self.short_stops.collect_orders_in_price_range(to_price, from_price, orders)
+            orders.sort(key=_order_price, reverse=True)
+        return orders
+
+    def get_orders_marketable_at(self, price: float):
+        # Orders that would trigger immediately at price, e.g. when a candle opens beyond them
+        orders = []
+        if self.long_orders.prices and price <= self.long_orders.prices[-1]:
+            self.long_orders.collect_orders_in_price_range(price, self.long_orders.prices[-1], orders)
+        if self.short_orders.prices and price >= self.short_orders.prices[0]:
+            self.short_orders.collect_orders_in_price_range(self.short_orders.prices[0], price, orders)
+        if self.long_stops.prices and price >= self.long_stops.prices[0]:
+            self.long_stops.collect_orders_in_price_range(self.long_stops.prices[0], price, orders)
+        if self.short_stops.prices and price <= self.short_stops.prices[-1]:
+            self.short_stops.collect_orders_in_price_range(price, self.short_stops.prices[-1], orders)
+        return orders
     
     def clear_orders(self):
         self.long_orders = OrderGroup()
         self.short_orders = OrderGroup()
+        self.long_stops = OrderGroup()
+        self.short_stops = OrderGroup()
         self.orders = {}
+        self.dirty = True
         
     def print_all_orders(self):
         print(f"Order Manager for {self.symbol}")
@@ -53,55 +103,123 @@ class OrderManager:
             print(f"  - {order}")
 
     def __str__(self):
-        return f"OrderManager(symbol={self.symbol}, total_orders={len(self.orders)}, long_orders={len(self.long_orders.get_orders())}, short_orders={len(self.short_orders.get_orders())})"
+        return f"OrderManager(symbol={self.symbol}, total_orders={len(self.orders)}, long_orders={len(self.long_orders)}, short_orders={len(self.short_orders)}, stop_orders={len(self.long_stops) + len(self.short_stops)})"
+
+def _order_price(order: BaseOrder) -> float:
+    return order.price
 
 '''
 This is a flexible way to group orders that share the same characteristic: direction, filled, canceled, long, short, etc.
 Used in OrderManager to seperate long orders from short orders for efficiency
+
+Orders are kept in a price level book: a sorted list of distinct prices (binary searched), and per price level
+the resting orders keyed by uid (in arrival order) and their aggregated size. Orders are removed by uid, so an
+order that is merely equal to another (same direction, size and price) is never removed in its place.
+
+Level sizes and the total size and value are exact: the correctly rounded sum of the resting orders, whatever
+sequence of adds and removes led to them, so no rounding residue builds up in a book that never empties.
+
+Adding or removing a price level shifts the list: O(levels), but a single memmove of a few microseconds even at 100k
+levels. That is kept over a tree with O(log n) updates because the per candle queries, which far outnumber order
+changes, only bisect and index the plain list.
 '''
 class OrderGroup:
     def __init__(self):
-        self.price_tree = FastRBTree()
+        self.prices = []
+        self.levels = {}
+        self.level_sizes = {}
         self.total_size = 0
         self.total_value = 0
+        self.order_count = 0
+        self._size_sum = _ExactSum()
+        self._value_sum = _ExactSum()
 
     def add_order(self, order: BaseOrder):
-        if order.price not in self.price_tree:
-            self.price_tree[order.price] = []
-        self.price_tree[order.price].append(order)
+        level = self.levels.get(order.price)
+        if level is None:
+            insort(self.prices, order.price)
+            level = self.levels[order.price] = {}
         
-        self.total_size += order.size
-        self.total_value += order.size * order.price
+        level[order.uid] = order
+        self.level_sizes[order.price] = math.fsum(level_order.size for level_order in level.values())
+        self.order_count += 1
+        
+        self.total_size = self._size_sum.add(order.size)
+        self.total_value = self._value_sum.add(order.size * order.price)
         
     def remove_order(self, order: BaseOrder):
-        if order.price in self.price_tree:
-            self.price_tree[order.price].remove(order)
-            if not self.price_tree[order.price]:
-                del self.price_tree[order.price]
+        level = self.levels.get(order.price)
+        if level is None or order.uid not in level:
+            raise ValueError(f"Order {order.uid} not found at price {order.price}.")
+        
+        del level[order.uid]
+        self.order_count -= 1
+        if level:
+            self.level_sizes[order.price] = math.fsum(level_order.size for level_order in level.values())
+        else:
+            del self.levels[order.price]
+            del self.level_sizes[order.price]
+            del self.prices[bisect_left(self.prices, order.price)]
         
-        self.total_size -= order.size
-        self.total_value -= order.size * order.price
+        if self.order_count:
+            self.total_size = self._size_sum.add(-order.size)
+            self.total_value = self._value_sum.add(-order.size * order.price)
+        else:
+            # Empty, start the sums over rather than carry partials that add up to zero
+            self._size_sum = _ExactSum()
+            self._value_sum = _ExactSum()
+            self.total_size = 0
+            self.total_value = 0
 
     def get_orders_in_price_range(self, low_price: float, high_price: float):
+        # Both bounds are inclusive
         orders = []
-        
-        for _, orders_in_range in self.price_tree.item_slice(low_price, high_price):
-            orders.extend(orders_in_range)
+        self.collect_orders_in_price_range(low_price, high_price, orders)
         return orders
     
+    def collect_orders_in_price_range(self, low_price: float, high_price: float, orders: list):
+        # Appends the orders with low_price <= price <= high_price to orders, by ascending price
+        for i in range(bisect_left(self.prices, low_price), bisect_right(self.prices, high_price)):
+            orders.extend(self.levels[self.prices[i]].values())
+    
     def get_orders(self):
-        return [order for orders in self.price_tree.values() for order in orders]
+        return [order for price in self.prices for order in self.levels[price].values()]
+
+    def __len__(self):
+        return self.order_count
 
     def print_all_orders(self):
-        if self.price_tree.is_empty():
+        if not self.prices:
             print("No orders in this OrderGroup.")
             return
 
-        total_orders = sum(len(orders) for orders in self.price_tree.values())
-        print(f"Total Orders: {total_orders}")
+        print(f"Total Orders: {self.order_count}")
         print(f"Total Size: {self.total_size}")
         print(f"Total Value: {self.total_value:.2f}")
         print("\nOrders:")
-        for _, orders in self.price_tree.items():
-            for order in orders:
-                print(f"  - UID: {order.uid}, Price: {order.price}, Size: {order.size}, Direction: {order.direction.name}")
\ No newline at end of file
+        for price in self.prices:
+            for order in self.levels[price].values():
+                print(f"  - UID: {order.uid}, Price: {order.price}, Size: {order.size}, Direction: {order.direction.name}")
+
+class _ExactSum:
+    # Running sum kept exactly as non-overlapping partials (Shewchuk's algorithm, as in math.fsum), so subtracting a value
+    # that was added leaves no residue. add() returns the correctly rounded sum, a few partials are enough in practice.
+    __slots__ = ('partials',)
+
+    def __init__(self):
+        self.partials = []
+
+    def add(self, x: float) -> float:
+        partials = self.partials
+        i = 0
+        for y in partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            high = x + y
+            low = y - (high - x)
+            if low:
+                partials[i] = low
+                i += 1
+            x = high
+        partials[i:] = [x]
+        return math.fsum(partials)
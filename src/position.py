@@ -1,15 +1,19 @@
 from src.order import BaseOrder, OrderDirection
 
 class Position:
+    __slots__ = ('symbol', 'direction', 'entry_price', 'size', 'dirty')
+
     def __init__(self, symbol, direction: OrderDirection = None, entry_price: float = 0, size: float = 0):
         self.symbol = symbol
         self.direction = direction
         self.entry_price = entry_price
         self.size = size
+        self.dirty = True  # Set on every change, cleared by the account once it has recomputed what depends on the position
 
     def add_filled_order(self, order: BaseOrder) -> float:
         # Adds order to existing position and returns the realized pnl
         
+        self.dirty = True
         new_position_size = self._calculate_new_position_size(order)
         
         # Case with no previous position - Filled order becomes position.
@@ -28,6 +32,9 @@ class Position:
         
         # Cases where order decreased position
         elif self.direction != order.direction:
+            # Realized pnl depends on the position before this order, so it must be calculated before it is modified
+            realized_pnl = self._calculate_added_order_pnl(order)
+            
             # Order closed position
             if new_position_size == 0:
                 self.direction = None
@@ -38,7 +45,12 @@ class Position:
                 self.entry_price = order.price
             
             self.size = new_position_size
-            return self._calculate_added_order_pnl(order)
+            return realized_pnl
+    
+    @property
+    def signed_size(self) -> float:
+        # Positive when long, negative when short
+        return self.size * self.direction if self.direction is not None else 0.0
     
     def calculate_unrealized_pnl(self, mark_price: float) -> float:
         if self.direction == OrderDirection.LONG:
@@ -57,6 +69,7 @@ class Position:
     def close_position(self, mark_price: float) -> float:
         realized_pnl =  self.calculate_unrealized_pnl(mark_price)
 
+        self.dirty = True
         self.direction = None
         self.entry_price = 0
         self.size = 0
@@ -83,5 +96,5 @@ class Position:
             return (self.entry_price - added_order.price) * size_filled
         
     def __repr__(self):
-        direction_value = self.direction.value if self.direction is not None else "None"
+        direction_value = self.direction.name if self.direction is not None else "None"
         return f"Position(symbol={self.symbol}, direction={direction_value}, size={self.size}, entry_price={self.entry_price})"
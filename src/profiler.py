@@ -0,0 +1,114 @@
+from typing import Dict
+import json
+import time
+
+# Methods attach() times on the strategy, its account, the account's order manager and its fill model
+STRATEGY_PHASES = ('new_candle', 'before', 'update_position', 'should_place_order', 'should_long', 'should_short', 'go_long', 'go_short')
+ACCOUNT_PHASES = ('update_pnl', 'check_for_filled_orders', 'check_liquidation', 'add_market_order', 'apply_funding')
+ORDER_MANAGER_PHASES = ('add_order', 'remove_order', 'get_triggered_orders', 'get_orders_crossed_by', 'get_orders_marketable_at')
+FILL_MODEL_PHASES = ('price_path',)
+
+'''
+Times the phases of a simulation: the strategy callbacks, the account's per candle work and the order book operations.
+
+attach() replaces the methods listed above with timing wrappers on the strategy's own instances (never on the classes), and
+detach() removes them again, so a run without a profiler executes exactly the same code as before with no checks in the loop.
+Times are inclusive: strategy.new_candle contains the callbacks it makes, account.check_for_filled_orders contains the order
+book calls and liquidation checks it makes.
+
+With sample_every=N only every Nth call of a phase is timed and the time is scaled by N, which keeps the cost of reading the
+clock off most calls. Call counts are always exact.
+'''
+class Profiler:
+    def __init__(self, sample_every: int = 1):
+        if sample_every < 1:
+            raise ValueError(f"sample_every must be at least 1, got {sample_every}")
+        self.sample_every = sample_every
+        self.calls: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+        self.candles = 0
+        self.elapsed = 0.0
+        self._started = None
+        self._attached = []
+
+    def attach(self, strategy):
+        account = strategy.account
+        self._wrap(strategy, 'strategy', STRATEGY_PHASES)
+        self._wrap(account, 'account', ACCOUNT_PHASES)
+        self._wrap(account.order_manager, 'order_manager', ORDER_MANAGER_PHASES)
+        self._wrap(account.fill_model, 'fill_model', FILL_MODEL_PHASES)
+
+    def detach(self):
+        for instance, name in self._attached:
+            del instance.__dict__[name]
+        self._attached = []
+
+    def start(self):
+        self._started = time.perf_counter()
+
+    def stop(self, candles: int):
+        self.elapsed += time.perf_counter() - self._started
+        self.candles += candles
+        self._started = None
+
+    def report(self) -> Dict:
+        phases = {}
+        for name, calls in self.calls.items():
+            seconds = self.seconds[name]
+            phases[name] = {
+                'calls': calls,
+                'seconds': seconds,
+                'us_per_call': seconds / calls * 1e6 if calls else 0.0,
+                'share': seconds / self.elapsed if self.elapsed else 0.0
+            }
+
+        return {
+            'candles': self.candles,
+            'seconds': self.elapsed,
+            'candles_per_second': self.candles / self.elapsed if self.elapsed else 0.0,
+            'sample_every': self.sample_every,
+            'phases': dict(sorted(phases.items(), key=lambda phase: -phase[1]['seconds']))
+        }
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def _wrap(self, instance, prefix: str, method_names):
+        for method_name in method_names:
+            method = getattr(instance, method_name, None)
+            if method is None:
+                continue
+            phase = f"{prefix}.{method_name}"
+            self.calls.setdefault(phase, 0)
+            self.seconds.setdefault(phase, 0.0)
+            instance.__dict__[method_name] = self._timed(method, phase)
+            self._attached.append((instance, method_name))
+
+    def _timed(self, method, phase: str):
+        calls = self.calls
+        seconds = self.seconds
+        sample_every = self.sample_every
+        clock = time.perf_counter
+
+        if sample_every == 1:
+            def timed(*args, **kwargs):
+                calls[phase] += 1
+                started = clock()
+                result = method(*args, **kwargs)
+                seconds[phase] += clock() - started
+                return result
+            return timed
+
+        def sampled(*args, **kwargs):
+            count = calls[phase] = calls[phase] + 1
+            if count % sample_every:
+                return method(*args, **kwargs)
+            started = clock()
+            result = method(*args, **kwargs)
+            seconds[phase] += (clock() - started) * sample_every
+            return result
+        return sampled
+
+    def __repr__(self) -> str:
+        return f"Profiler(sample_every={self.sample_every}, candles={self.candles}, seconds={self.elapsed:.3f})"
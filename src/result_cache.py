@@ -0,0 +1,109 @@
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+# Part of every cache key, bump it whenever a change to the simulation engine (or to what a result holds) changes results so old entries stop matching
+ENGINE_VERSION = 2
+
+RESULT_SUFFIX = '.npz'
+METRICS_ENTRY = 'metrics'
+
+def file_fingerprint(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def backtest_key(strategy_fingerprint: str, hyperparameters: Dict, candles: np.ndarray, **settings) -> str:
+    # Content address of a backtest: the strategy source, its hyperparameters, the candles it runs on (their bytes, so
+    # a changed data file can't return a stale result), any other settings that affect it and the engine version
+    digest = hashlib.sha256()
+    digest.update(f"engine={ENGINE_VERSION};strategy={strategy_fingerprint};".encode())
+    digest.update(json.dumps(hyperparameters, sort_keys=True, default=str).encode())
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    digest.update(np.ascontiguousarray(candles).tobytes())
+    return digest.hexdigest()
+
+'''
+On-disk cache of backtest results keyed by backtest_key. Each entry is one compressed .npz holding the result's arrays
+and its metrics as json. Float curves (prices, equity) are stored as float32, plenty for plotting and half the size,
+other arrays (timestamps, fills) as they are. When the entries add up to more than max_bytes the least recently used
+ones are deleted.
+'''
+class ResultCache:
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        # key -> (size, last used), the file mtime doubles as the last used time so it survives restarts
+        self._entries: Dict[str, Tuple[int, float]] = {}
+        for name in os.listdir(directory):
+            if name.endswith(RESULT_SUFFIX):
+                stat = os.stat(os.path.join(directory, name))
+                self._entries[name[:-len(RESULT_SUFFIX)]] = (stat.st_size, stat.st_mtime)
+        self._total_bytes = sum(size for size, _ in self._entries.values())
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, np.ndarray], Dict]]:
+        # Returns (arrays, metrics) or None
+        with self._lock:
+            if key not in self._entries:
+                return None
+            path = self._path(key)
+            try:
+                with np.load(path) as data:
+                    arrays = {name: data[name] for name in data.files if name != METRICS_ENTRY}
+                    result = arrays, json.loads(str(data[METRICS_ENTRY]))
+            except (OSError, ValueError, KeyError):
+                self._remove(key) # Unreadable entry, treat as a miss
+                return None
+            os.utime(path)
+            self._entries[key] = (self._entries[key][0], os.stat(path).st_mtime)
+            return result
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray], metrics: Dict):
+        compact = {}
+        for name, values in arrays.items():
+            values = np.asarray(values)
+            compact[name] = values.astype(np.float32) if values.dtype == np.float64 else values
+        
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **compact, **{METRICS_ENTRY: np.array(json.dumps(metrics, default=float))})
+
+        with self._lock:
+            os.replace(tmp_path, path)
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][0]
+            stat = os.stat(path)
+            self._entries[key] = (stat.st_size, stat.st_mtime)
+            self._total_bytes += stat.st_size
+            self._evict()
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key in sorted(self._entries, key=lambda key: self._entries[key][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._remove(key)
+
+    def _remove(self, key: str):
+        size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + RESULT_SUFFIX)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return f"ResultCache(directory={self.directory}, entries={len(self._entries)}, bytes={self._total_bytes}/{self.max_bytes})"
@@ -1,86 +1,476 @@
-from src.strategy import Strategy
-from src.account import Account
+from src.strategy import Strategy, load_strategy_class
+from src.account import Account, PortfolioAccount
+from src.candle_manager import merge_candle_streams
+from src.candle_window import CandleWindow
+from src.cost_model import CostModel, FundingSchedule
+from src.profiler import Profiler
+from src.metrics import PERFORMANCE_METRICS
+from src.result_cache import backtest_key, file_fingerprint
 from src.order import *
+from typing import Dict, List
 
+from concurrent.futures import ProcessPoolExecutor, wait
+import hashlib
+import inspect
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
 import optuna
+from optuna.storages import JournalStorage
+from optuna.storages.journal import JournalFileBackend
 
-def objective(trial, candles, warmup_candles):
+def objective(trial, candles, warmup_candles, strategy_class=Strategy, checkpoints=0, target='total_collateral', cost_model: CostModel = None):
+    # checkpoints > 0 reports the target so far to the study that many times, evenly spaced, and prunes the trial when the
+    # study's pruner says so. Liquidated accounts always stop at the candle they hit zero health.
+    # target is 'total_collateral' or any of PERFORMANCE_METRICS, see target_direction() for the study's direction.
+    # cost_model charges fees, slippage and funding, so trials that overtrade pay for it.
+    account = Account("SOLPERP", 1000, 0.1, 0.05, check_invariants=False, cost_model=cost_model)
+    strategy = strategy_class(account)
+    strategy.hp = suggest_hyperparameters(trial, strategy)
+    
+    pruned = False
+    def report(candle_index, strategy):
+        nonlocal pruned
+        trial.report(target_value(strategy, target), candle_index)
+        pruned = trial.should_prune()
+        return pruned
+    
+    checkpoint_every = (len(candles) - warmup_candles) // (checkpoints + 1) if checkpoints else 0
+    run_simulation(strategy, candles, warmup_candles, stop_on_liquidation=True,
+                   on_checkpoint=report if checkpoint_every else None, checkpoint_every=checkpoint_every)
+    
+    if pruned:
+        raise optuna.TrialPruned()
+    
+    return target_value(strategy, target)
+
+def target_value(strategy, target='total_collateral'):
+    if target == 'total_collateral':
+        return strategy.account.collateral_manager.total_collateral
+    return strategy.metrics.performance()[target]
+
+def target_direction(target='total_collateral') -> str:
+    if target == 'total_collateral':
+        return 'maximize'
+    if target not in PERFORMANCE_METRICS:
+        raise ValueError(f"Unknown optimization target '{target}', expected 'total_collateral' or one of {tuple(PERFORMANCE_METRICS)}")
+    return PERFORMANCE_METRICS[target]
+
+def suggest_hyperparameters(trial, strategy):
     params = {}
-    account = Account("SOLPERP", 1000, 0.1, 0.05)
-    strategy = Strategy(account)
     
     # Suggest values for each hyperparameter
-    for param in strategy.hyperparameters():
+    for param in strategy.hyperparameters() or []:
         if param['type'] == float:
             params[param['name']] = trial.suggest_float(param['name'], param['min'], param['max'])
         elif param['type'] == int:
             params[param['name']] = trial.suggest_int(param['name'], param['min'], param['max'])
     
-    strategy.hp = params
-    run_simulation(strategy, candles, warmup_candles)
-    
-    return account.collateral_manager.total_collateral
+    return params
 
-def optimize_hyperparameters(candles, warmup_candles, n_trials=50):
+def optimize_hyperparameters(candles, warmup_candles, n_trials=50, strategy_class=Strategy, n_jobs=1, storage_path=None, checkpoints=0, pruner=None, batch_size=1, target='total_collateral', cost_model: CostModel = None):
+    # n_jobs > 1 runs trials in that many processes. They share one study through a journal file at storage_path
+    # (a temporary file when None) and read candles from a memory-mapped copy instead of receiving them pickled.
+    # checkpoints/pruner enable early stopping of hopeless trials, see objective(). Defaults to a median pruner.
+    # batch_size > 1 runs that many trials at once in a single pass over the candles (run_batch_simulation), without pruning.
+    # target is the value optimized, see objective().
     optuna.logging.set_verbosity(optuna.logging.WARNING)
-    study = optuna.create_study(direction='maximize')
-    study.optimize(lambda trial: objective(trial, candles, warmup_candles), n_trials=n_trials, )
+    direction = target_direction(target)
+    
+    if batch_size > 1:
+        if n_jobs > 1:
+            raise ValueError("Batched trials run in a single process, use either n_jobs or batch_size")
+        study = optuna.create_study(direction=direction, storage=_journal_storage(storage_path) if storage_path else None)
+        _optimize_in_batches(study, candles, warmup_candles, n_trials, strategy_class, batch_size, target, cost_model)
+        return study.best_params, study.best_value
+    
+    if n_jobs > 1:
+        return _optimize_in_processes(candles, warmup_candles, n_trials, strategy_class, n_jobs, storage_path, checkpoints, pruner, target, cost_model)
+    
+    study = optuna.create_study(direction=direction, storage=_journal_storage(storage_path) if storage_path else None, pruner=_pruner(checkpoints, pruner))
+    study.optimize(lambda trial: objective(trial, candles, warmup_candles, strategy_class, checkpoints, target, cost_model), n_trials=n_trials, )
 
     return study.best_params, study.best_value
 
-def dynamic_optimization(candles, trials, test_start, test_end, look_back_period, update_period, warmup_candles=0):
-    
-    param_list = []
+def _optimize_in_batches(study, candles, warmup_candles, n_trials, strategy_class, batch_size, target='total_collateral', cost_model: CostModel = None):
+    for first_trial in range(0, n_trials, batch_size):
+        trials = [study.ask() for _ in range(min(batch_size, n_trials - first_trial))]
+        
+        strategies = []
+        for trial in trials:
+            strategy = strategy_class(Account("SOLPERP", 1000, 0.1, 0.05, check_invariants=False, cost_model=cost_model))
+            strategy.hp = suggest_hyperparameters(trial, strategy)
+            strategies.append(strategy)
+        
+        run_batch_simulation(strategies, candles, warmup_candles, stop_on_liquidation=True)
+        
+        for trial, strategy in zip(trials, strategies):
+            study.tell(trial, target_value(strategy, target))
+
+def _pruner(checkpoints, pruner):
+    if not checkpoints:
+        return optuna.pruners.NopPruner()
+    return pruner or optuna.pruners.MedianPruner(n_startup_trials=5)
+
+def _optimize_in_processes(candles, warmup_candles, n_trials, strategy_class, n_jobs, storage_path, checkpoints=0, pruner=None, target='total_collateral', cost_model: CostModel = None):
+    work_dir = tempfile.mkdtemp(prefix='futureproof_')
+    try:
+        candles_path = share_candles(candles, work_dir)
+        storage_path = storage_path or os.path.join(work_dir, 'study.journal')
+        study_name = f"optimize-{uuid.uuid4().hex}"
+        optuna.create_study(study_name=study_name, direction=target_direction(target), storage=_journal_storage(storage_path))
+        
+        # Split the trials evenly, the study's sampler sees every finished trial regardless of which worker ran it
+        trials_per_worker = [n_trials // n_jobs + (1 if worker < n_trials % n_jobs else 0) for worker in range(n_jobs)]
+        strategy_ref = strategy_reference(strategy_class)
+        pruner = _pruner(checkpoints, pruner)
+        
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [
+                executor.submit(_optimize_worker, study_name, storage_path, candles_path, warmup_candles, strategy_ref, worker_trials,
+                                checkpoints=checkpoints, pruner=pruner, target=target, cost_model=cost_model)
+                for worker_trials in trials_per_worker if worker_trials
+            ]
+            for future in futures:
+                future.result()
+        
+        study = optuna.load_study(study_name=study_name, storage=_journal_storage(storage_path))
+        return study.best_params, study.best_value
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _optimize_worker(study_name, storage_path, candles_path, warmup_candles, strategy_ref, n_trials, candle_range=None, progress=None, checkpoints=0, pruner=None, target='total_collateral', cost_model: CostModel = None):
+    # candle_range selects a slice of the shared candles, progress is a queue that receives (study_name, trial value) after every trial
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    candles = np.load(candles_path, mmap_mode='r')
+    if candle_range:
+        candles = candles[candle_range[0]:candle_range[1]]
+    strategy_class = resolve_strategy(strategy_ref)
     
-    # Optimize parameters
+    callbacks = [lambda _, trial: progress.put((study_name, trial.value))] if progress is not None else None
+    # Pruners aren't persisted in the storage, every process has to pass the same one
+    study = optuna.load_study(study_name=study_name, storage=_journal_storage(storage_path), pruner=pruner)
+    study.optimize(lambda trial: objective(trial, candles, warmup_candles, strategy_class, checkpoints, target, cost_model), n_trials=n_trials, callbacks=callbacks)
+
+def _journal_storage(path):
+    # File based storage that several processes can share without a database server
+    return JournalStorage(JournalFileBackend(path))
+
+def share_candles(candles, directory) -> str:
+    # Write candles once to a .npy file that worker processes memory-map, so every worker shares the same page cache
+    path = os.path.join(directory, 'candles.npy')
+    np.save(path, np.ascontiguousarray(candles))
+    return path
+
+def strategy_reference(strategy_class):
+    # Classes loaded from a file (like the dashboard's strategies) can't be pickled by name, send the file path instead
+    try:
+        pickle.dumps(strategy_class)
+        return strategy_class
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return strategy_class.source_file or inspect.getfile(strategy_class)
+
+def resolve_strategy(strategy_ref):
+    if isinstance(strategy_ref, str):
+        return load_strategy_class(strategy_ref)
+    return strategy_ref
+
+def dynamic_optimization(candles, trials, test_start, test_end, look_back_period, update_period, warmup_candles=0, strategy_class=Strategy, n_jobs=1, checkpoint_dir=None, checkpoints=0, pruner=None, target='total_collateral', cost_model: CostModel = None):
+    # Optimizes every look-back window, n_jobs > 1 runs windows (and trials within a window) concurrently.
+    # With checkpoint_dir each window's study is kept in a journal file there, so rerunning after a crash
+    # only runs the trials that hadn't finished. Studies are named after everything their trials depend on (strategy source,
+    # target, costs and the window's candles), so a run with different settings starts new studies instead of resuming them.
+    windows = []
     for i in range(test_start - look_back_period, test_end - look_back_period, update_period):
-        start_candle = i - warmup_candles
-        end_candle = i + look_back_period
-        optimization_candles = candles[start_candle : end_candle]
-        print(f"Optimizing range: {start_candle + warmup_candles} - {end_candle}")
-        results, _ = optimize_hyperparameters(optimization_candles, warmup_candles, trials)
-        param_list.append(results)
+        windows.append((i - warmup_candles, i + look_back_period))
     
-    return param_list
+    work_dir = tempfile.mkdtemp(prefix='futureproof_')
+    try:
+        storage_dir = checkpoint_dir or work_dir
+        os.makedirs(storage_dir, exist_ok=True)
+        
+        pruner = _pruner(checkpoints, pruner)
+        study_names = _window_study_names(candles, windows, strategy_class, warmup_candles, target, cost_model)
+        studies = [_window_study(storage_dir, study_name, pruner, target) for study_name in study_names]
+        remaining = [max(0, trials - _finished_trials(study)) for study in studies]
+        
+        if n_jobs > 1:
+            _optimize_windows_in_processes(candles, windows, studies, remaining, storage_dir, work_dir, warmup_candles, strategy_class, n_jobs, trials, checkpoints, pruner, target, cost_model)
+        else:
+            for (start_candle, end_candle), study, window_trials in zip(windows, studies, remaining):
+                print(f"Optimizing range: {start_candle + warmup_candles} - {end_candle}")
+                optimization_candles = candles[start_candle : end_candle]
+                study.optimize(lambda trial: objective(trial, optimization_candles, warmup_candles, strategy_class, checkpoints, target, cost_model), n_trials=window_trials)
+        
+        return [_window_study(storage_dir, study_name, target=target).best_params for study_name in study_names]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-def run_dynamic_params(candles, param_list, test_start, test_end, look_back_period, update_period, warmup_candles=0):
-    overall_balance_time_series = []
-    overall_asset_price_time_series = []
+def _window_study_names(candles, windows, strategy_class, warmup_candles, target='total_collateral', cost_model: CostModel = None):
+    strategy = _strategy_fingerprint(strategy_class)
+    costs = None
+    if cost_model is not None:
+        costs = [cost_model.maker_fee, cost_model.taker_fee, cost_model.slippage]
+        if cost_model.funding_times is not None:
+            costs.append(hashlib.sha256(cost_model.funding_times.tobytes() + cost_model.funding_rates.tobytes()).hexdigest())
     
-    account = Account("SOLUSDT", 1000, 0.1, 0.05)
-    strategy = Strategy(account)
+    names = []
+    for start_candle, end_candle in windows:
+        key = backtest_key(strategy, {}, candles[start_candle:end_candle], target=target, warmup_candles=warmup_candles, costs=costs)
+        names.append(f"window-{start_candle}-{end_candle}-{key[:16]}")
+    return names
+
+def _strategy_fingerprint(strategy_class) -> str:
+    name = f"{strategy_class.__module__}.{strategy_class.__qualname__}"
+    try:
+        return f"{name}:{file_fingerprint(strategy_class.source_file or inspect.getfile(strategy_class))}"
+    except (TypeError, OSError):
+        return name # Defined without a source file, e.g. interactively
+
+def _window_study(storage_dir, study_name, pruner=None, target='total_collateral'):
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    storage = _journal_storage(os.path.join(storage_dir, f"{study_name}.journal"))
+    return optuna.create_study(study_name=study_name, direction=target_direction(target), storage=storage, load_if_exists=True, pruner=pruner)
+
+def _finished_trials(study):
+    # Trials left RUNNING by a process that died are not counted and get rerun
+    return len(study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)))
+
+def _best_value(study):
+    values = [trial.value for trial in study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,))]
+    if not values:
+        return None
+    return min(values) if study.direction == optuna.study.StudyDirection.MINIMIZE else max(values)
+
+def _optimize_windows_in_processes(candles, windows, studies, remaining, storage_dir, work_dir, warmup_candles, strategy_class, n_jobs, trials, checkpoints=0, pruner=None, target='total_collateral', cost_model: CostModel = None):
+    # All windows share one pool. Fewer windows than workers splits each window's trials into several tasks so every
+    # core stays busy, more windows than workers gives each window a single task.
+    candles_path = share_candles(candles, work_dir)
+    strategy_ref = strategy_reference(strategy_class)
+    pending_windows = sum(1 for window_trials in remaining if window_trials)
+    tasks_per_window = max(1, n_jobs // max(1, pending_windows))
     
-    for idx, params in enumerate(param_list):
-        start = test_start + (idx * update_period) - warmup_candles
-        
-        end = min(start + update_period + warmup_candles, test_end)
-        test_candles = candles[start : end]
-        
-        strategy.hp = params
-        _, balance_time_series, asset_price_time_series = run_simulation(strategy, account, test_candles, warmup_candles)
-        print(f"Testing optimized params on range: {start + warmup_candles} - {end}. PNL:", strategy.account.collateral_manager.total_collateral)
+    progress = {study.study_name: [trials - window_trials, trials, _best_value(study)] for study, window_trials in zip(studies, remaining)}
+    
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        queue = manager.Queue()
+        futures = []
+        for (start_candle, end_candle), study, window_trials in zip(windows, studies, remaining):
+            storage_path = os.path.join(storage_dir, f"{study.study_name}.journal")
+            for task in range(tasks_per_window):
+                task_trials = window_trials // tasks_per_window + (1 if task < window_trials % tasks_per_window else 0)
+                if task_trials:
+                    futures.append(executor.submit(_optimize_worker, study.study_name, storage_path, candles_path, warmup_candles,
+                                                   strategy_ref, task_trials, (start_candle, end_candle), queue, checkpoints, pruner, target, cost_model))
         
-        overall_balance_time_series.extend(balance_time_series)
-        overall_asset_price_time_series.extend(asset_price_time_series)
+        not_done = futures
+        while not_done:
+            _, not_done = wait(not_done, timeout=1)
+            _report_window_progress(queue, progress, target_direction(target) == 'minimize')
+        for future in futures:
+            future.result()
+
+def _report_window_progress(queue, progress, minimize=False):
+    updated = set()
+    while not queue.empty():
+        study_name, value = queue.get()
+        window = progress[study_name]
+        window[0] += 1
+        if value is not None and (window[2] is None or (value < window[2] if minimize else value > window[2])):
+            window[2] = value
+        updated.add(study_name)
+    
+    for study_name in sorted(updated):
+        done, total, best = progress[study_name]
+        print(f"{study_name}: {done}/{total} trials, best {best:.3f}" if best is not None else f"{study_name}: {done}/{total} trials")
+
+def run_dynamic_params(candles, param_list, test_start, test_end, look_back_period, update_period, warmup_candles=0, strategy_class=Strategy, cost_model: CostModel = None):
+    # Runs every out-of-sample segment in one continuous simulation, switching hyperparameters at segment boundaries
+    account = Account("SOLUSDT", 1000, 0.1, 0.05, cost_model=cost_model)
+    strategy = strategy_class(account)
+    
+    first_candle = test_start - warmup_candles
+    test_candles = candles[first_candle : test_end]
+    
+    segment_starts = [test_start + idx * update_period for idx in range(len(param_list))]
+    param_schedule = [(start - first_candle, params) for start, params in zip(segment_starts, param_list) if start < test_end]
     
-def run_simulation(strategy: Strategy, candles, warmup_candles = 0):
+    _, balance_time_series, asset_price_time_series = run_simulation(strategy, test_candles, warmup_candles, param_schedule)
+    
+    for start, _ in param_schedule:
+        end = min(start + update_period, len(test_candles))
+        print(f"Testing optimized params on range: {first_candle + start} - {first_candle + end}. PNL:", balance_time_series[end - 1 - warmup_candles])
+    
+    return strategy, balance_time_series, asset_price_time_series
+    
+def run_simulation(strategy: Strategy, candles, warmup_candles = 0, param_schedule = None, stop_on_liquidation = False, on_checkpoint = None, checkpoint_every = 0,
+                   profiler: Profiler = None):
+    # param_schedule is an optional list of (candle index, hyperparameters) applied when the simulation reaches that candle.
+    # on_checkpoint(candle index, strategy) is called every checkpoint_every candles, returning True stops the simulation.
+    # stop_on_liquidation stops as soon as the account health reaches 0.
+    # profiler times the run's phases, see Profiler.report(). Without one the loop runs uninstrumented.
     
     portfoilio = []
     time_series = []
+    strategy.metrics.equity = portfoilio
+    
+    # Zero-copy view over candles that grows by one candle per loop
+    window = CandleWindow(candles, strategy.lookback, warmup_candles)
+    
+    schedule = sorted(param_schedule or [], key=lambda switch: switch[0])
+    next_switch = schedule[0][0] if schedule else None
+    next_checkpoint = warmup_candles + checkpoint_every if on_checkpoint and checkpoint_every > 0 else None
+    funding = FundingSchedule([strategy.account], candles["start"], warmup_candles)
+    next_funding = funding.next_index
+    
+    if profiler is not None:
+        profiler.attach(strategy)
+        profiler.start()
+    
+    try:
+        for i in range(warmup_candles, len(candles)):
+            while next_switch is not None and next_switch <= i:
+                strategy.set_hyperparameters(schedule.pop(0)[1])
+                next_switch = schedule[0][0] if schedule else None
+            
+            current_candle = candles[i]
+            candle_open = current_candle["open"]
+            if i == next_funding:
+                next_funding = funding.apply(i, candle_open)
+            
+            ###### Should only have access to the open. Prevent look ahead bias. #######
+            strategy.account.update_pnl(candle_open)
+            window.advance()
+            strategy.new_candle(window)
+            #######################################################################
+            
+            liquidation_price = strategy.account.check_for_filled_orders(current_candle["low"], current_candle["high"], candle_open, current_candle["close"], current_candle["start"], liquidate=True)
+            if liquidation_price is not None:
+                strategy.metrics.new_liquidation(liquidation_price)
+            
+            portfoilio.append(strategy.account.collateral_manager.total_collateral)
+            time_series.append(candle_open)
+            
+            if stop_on_liquidation and strategy.account.collateral_manager.account_health == 0:
+                break
+            if i == next_checkpoint:
+                if on_checkpoint(i, strategy):
+                    break
+                next_checkpoint += checkpoint_every
+    finally:
+        # Also on an exception, so the timing wrappers never outlive the run
+        if profiler is not None:
+            profiler.stop(len(portfoilio))
+            profiler.detach()
+    
+    if not strategy.account.collateral_manager.check_invariants:
+        strategy.account.collateral_manager.validate()
+
+    return strategy, portfoilio, time_series
+
+def run_batch_simulation(strategies: List[Strategy], candles, warmup_candles = 0, stop_on_liquidation = False):
+    # Advances independent strategies (each with its own account) in lockstep over one pass of the candles.
+    # Every strategy sees exactly what run_simulation would show it, but candle reads and indicators declared
+    # identically by several strategies are only paid for once.
+    portfolios = [[] for _ in strategies]
+    time_series = []
+    
+    shared_indicators = {}
+    windows = {}
+    for strategy in strategies:
+        strategy.shared_indicators = shared_indicators
+        if strategy.lookback not in windows:
+            windows[strategy.lookback] = CandleWindow(candles, strategy.lookback, warmup_candles)
+    
+    active = [(strategy, windows[strategy.lookback], portfolio) for strategy, portfolio in zip(strategies, portfolios)]
+    for strategy, portfolio in zip(strategies, portfolios):
+        strategy.metrics.equity = portfolio
+    funding = FundingSchedule([strategy.account for strategy in strategies], candles["start"], warmup_candles)
+    next_funding = funding.next_index
     
     for i in range(warmup_candles, len(candles)):
         current_candle = candles[i]
         candle_open = current_candle["open"]
+        low = current_candle["low"]
+        high = current_candle["high"]
+        close = current_candle["close"]
+        start = current_candle["start"]
+        if i == next_funding:
+            next_funding = funding.apply(i, candle_open)
         
-        ###### Should only have access to the open. Prevent look ahead bias. #######
-        strategy.account.update_pnl(candle_open)
-        candles_available_this_loop = candles[0 : i + 1]
-        strategy.new_candle(candles_available_this_loop)
-        #######################################################################
+        for window in windows.values():
+            window.advance()
         
-        strategy.account.check_for_filled_orders(current_candle["low"], current_candle["high"])
-        
-        portfoilio.append(strategy.account.collateral_manager.total_collateral)
+        for strategy, window, portfolio in active:
+            strategy.account.update_pnl(candle_open)
+            strategy.new_candle(window)
+            liquidation_price = strategy.account.check_for_filled_orders(low, high, candle_open, close, start, liquidate=True)
+            if liquidation_price is not None:
+                strategy.metrics.new_liquidation(liquidation_price)
+            portfolio.append(strategy.account.collateral_manager.total_collateral)
         time_series.append(candle_open)
+        
+        if stop_on_liquidation:
+            active = [entry for entry in active if entry[0].account.collateral_manager.account_health != 0]
+            if not active:
+                break
+    
+    for strategy in strategies:
+        if not strategy.account.collateral_manager.check_invariants:
+            strategy.account.collateral_manager.validate()
+    
+    return strategies, portfolios, time_series
 
-    return strategy, portfoilio, time_series
+def run_portfolio_simulation(account: PortfolioAccount, strategies: Dict[str, Strategy], candles: Dict[str, np.ndarray], warmup_candles = 0, stop_on_liquidation = False):
+    # Runs one strategy per symbol on a cross-margin PortfolioAccount, each strategy built on account[symbol].
+    # The symbols' candles are merged by start time, so each bar only runs the symbols that printed a candle in it.
+    # Returns the strategies, the portfolio value after each bar and the start time of each bar.
+    symbols = list(strategies)
+    streams = [candles[symbol] for symbol in symbols]
+    ordered_strategies = [strategies[symbol] for symbol in symbols]
+    windows = [CandleWindow(candles[symbol], strategies[symbol].lookback, warmup_candles) for symbol in symbols]
+    collateral_manager = account.collateral_manager
+    
+    portfolio = []
+    time_series = []
+    # Collateral is shared, so every strategy's metrics see the portfolio's equity
+    for strategy in ordered_strategies:
+        strategy.metrics.equity = portfolio
+    # Funding follows each symbol's own candles
+    funding = [FundingSchedule([account[symbol]], candles[symbol]["start"], warmup_candles) for symbol in symbols]
+    next_funding = [schedule.next_index for schedule in funding]
+    
+    for start, printed in merge_candle_streams(streams, [warmup_candles] * len(streams)):
+        for stream, index in printed:
+            strategy = ordered_strategies[stream]
+            window = windows[stream]
+            current_candle = streams[stream][index]
+            candle_open = current_candle["open"]
+            if index == next_funding[stream]:
+                next_funding[stream] = funding[stream].apply(index, candle_open)
+            
+            account.update_pnl(symbols[stream], candle_open)
+            window.advance()
+            # Fills and liquidations are logged on the bar clock of the shared equity curve, not the symbol's own candle count
+            strategy.metrics.current_candle_index = len(portfolio) - 1 # new_candle advances it to this bar
+            strategy.new_candle(window)
+            
+            liquidation_price = strategy.account.check_for_filled_orders(current_candle["low"], current_candle["high"], candle_open, current_candle["close"], start, liquidate=True)
+            if liquidation_price is not None:
+                strategy.metrics.new_liquidation(liquidation_price)
+        
+        portfolio.append(collateral_manager.total_collateral)
+        time_series.append(start)
+        
+        if stop_on_liquidation and collateral_manager.account_health == 0:
+            break
+    
+    if not collateral_manager.check_invariants:
+        collateral_manager.validate()
+    
+    return strategies, portfolio, time_series
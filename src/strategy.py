@@ -1,27 +1,48 @@
 from abc import ABC
+import importlib.util
+import inspect
+import os
 from typing import List, Dict, Optional, final
 from src.order import BaseOrder, BracketOrder
 from src.account import Account
 from src.metrics import Metrics
+from src.candle_window import CandleWindow, TimeframeWindow
+from src.indicators import IndicatorSet
 
 class Strategy(ABC):
+    # Maximum number of closed candles visible through self.candles, None for the full history
+    lookback: Optional[int] = None
+    # 'stream' updates indicators as each candle closes, 'precompute' computes their full series up front
+    indicator_mode: str = 'stream'
+    # Path of the file the strategy was loaded from by load_strategy_class
+    source_file: Optional[str] = None
+
     def __init__(self, account: Account):
         self.account = account
         self.hp: Dict[str, any] = {}  # Hyperparameters
         self.current_price: Optional[float] = None
-        self.candles: Optional[List[Dict]] = None
+        self.candles: Optional[CandleWindow] = None
+        self.ind: Optional[IndicatorSet] = None  # Indicator values, built from indicators() on the first candle
+        self.shared_indicators: Optional[Dict] = None  # Set by batch runs so strategies with the same indicators share them
+        self.timeframes: Dict[any, TimeframeWindow] = {}  # Higher timeframe views keyed by timeframe, see timeframe()
         self.set_default_hyperparameters()
         self.metrics = Metrics(account.collateral_manager.balance)
+        account.on_fill = self.metrics.new_fill
+        account.on_funding = self.metrics.new_funding
         
     @final
-    def new_candle(self, candles: List[Dict]):
+    def new_candle(self, candles: CandleWindow):
         
         self.metrics.new_candle()
         
-        # passing huge lists of candles seems crazy, is it more efficient to pass a single kline and append it
-        self.current_price = candles[-1]["open"]
+        self.current_price = candles.current_open
         self.candles = candles
         
+        # Built lazily so declarations can depend on hyperparameters set after __init__ (e.g. by the optimizer)
+        if self.ind is None:
+            self.ind = IndicatorSet(self.indicators() or [], self.indicator_mode, self.shared_indicators)
+        self.ind.advance(candles)
+        
         self.before()
         
         if self.account.position.direction:
@@ -42,9 +63,27 @@ class Strategy(ABC):
             default = param['default']
             self.hp[name] = default
             
+    @final
+    def set_hyperparameters(self, params: Dict[str, any]):
+        """Replace the hyperparameters mid-run, indicators are rebuilt since their declarations may depend on them."""
+        self.hp = params
+        self.ind = None
+
+    @final
+    def timeframe(self, timeframe) -> TimeframeWindow:
+        """Look-ahead safe view of the candles in a higher timeframe, e.g. self.timeframe('1h')[-2] is the last closed hourly bar."""
+        view = self.timeframes.get(timeframe)
+        if view is None or view.window is not self.candles:
+            view = TimeframeWindow(self.candles, timeframe)
+            self.timeframes[timeframe] = view
+        return view
+
     def hyperparameters(self) -> List[Dict]:
         """Define the hyperparameters for the strategy."""
 
+    def indicators(self) -> List[Dict]:
+        """Define the indicators the strategy reads through self.ind, e.g. {'name': 'fast', 'type': EMA, 'period': self.hp['fast_period']}."""
+
     def before(self):
         """Method called at the beginning of each new candle."""
     
@@ -95,4 +134,18 @@ class Strategy(ABC):
     def on_decreased_position(self, order: BaseOrder):
         """Called when position size is decreased"""
     def on_cancel(self):
-        """Called when order is cancelled"""
\ No newline at end of file
+        """Called when order is cancelled"""
+
+def load_strategy_class(path: str) -> type:
+    # Import a strategy file and return the Strategy subclass it defines
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    
+    for _, obj in inspect.getmembers(module, inspect.isclass):
+        if issubclass(obj, Strategy) and obj is not Strategy and obj.__module__ == module_name:
+            obj.source_file = path
+            return obj
+    
+    raise ValueError(f"No subclass of Strategy found in the strategy file {path}")
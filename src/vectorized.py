@@ -0,0 +1,304 @@
+from typing import Optional, Union
+import numpy as np
+
+from src.account import Account
+from src.order import BaseOrder, BracketOrder, OrderDirection
+from src.strategy import Strategy
+
+# Kinds of fills in VectorizedResult.fills
+ENTRY = 0
+TAKE_PROFIT = 1
+EXIT = 2
+
+FILL_DTYPE = np.dtype([
+    ('index', 'i8'),
+    ('kind', 'i1'),
+    ('direction', 'i1'),
+    ('price', 'f8'),
+    ('size', 'f8'),
+    ('realized_pnl', 'f8')
+])
+
+'''
+Vectorized backtest engine for stateless signal strategies.
+
+signals[i] is the side wanted at the open of candle i: 1 long, -1 short, 0 flat. It must only depend on candles before i,
+signals_from_conditions() builds it from conditions evaluated on closed candles.
+The rules are the ones SignalStrategy applies through Account:
+ - when flat and signals[i] != 0, a market order of `size` is opened at the open of candle i, if the margin allows it,
+   together with a take profit limit order at open * (1 +/- take_profit)
+ - when in a position and signals[i] differs from its side, the position is closed at the open of candle i
+ - the take profit fills on any candle (including the entry candle) whose low/high reaches it
+Work is done per trade with array searches over the candles, never per candle in python.
+'''
+class VectorizedResult:
+    def __init__(self, portfolio, time_series, position, entry_price, balance, unrealized_pnl, fills):
+        # portfolio/time_series follow run_simulation: one value per candle from warmup on, marked at each candle's open
+        self.portfolio = portfolio
+        self.time_series = time_series
+        # Per candle state at the end of the candle
+        self.position = position
+        self.entry_price = entry_price
+        self.balance = balance
+        # Unrealized pnl of the position carried into each candle, marked at its open
+        self.unrealized_pnl = unrealized_pnl
+        self.fills = fills
+
+    def __repr__(self) -> str:
+        return f"VectorizedResult(candles={len(self.portfolio)}, fills={len(self.fills)}, end_balance={self.balance[-1] if len(self.balance) else None})"
+
+def signals_from_conditions(long_condition: np.ndarray, short_condition: Optional[np.ndarray] = None) -> np.ndarray:
+    # Conditions are evaluated on closed candles, so the signal of candle i is the condition of candle i - 1. Long wins ties.
+    signals = np.zeros(len(long_condition), dtype='i1')
+    if short_condition is not None:
+        signals[1:][np.asarray(short_condition[:-1], dtype=bool)] = -1
+    signals[1:][np.asarray(long_condition[:-1], dtype=bool)] = 1
+    return signals
+
+def run_vectorized(candles: np.ndarray, signals: np.ndarray, take_profit: Union[float, np.ndarray, None] = None,
+                   size: float = 1, starting_balance: float = 1000, initial_margin_ratio: float = 0.1, maintenance_margin_ratio: float = 0.05,
+                   warmup_candles: int = 0, parity: bool = False) -> VectorizedResult:
+    n = len(candles)
+    signals = np.asarray(signals)
+    if len(signals) != n:
+        raise ValueError(f"Expected {n} signals, got {len(signals)}")
+
+    opens = np.ascontiguousarray(candles['open'], dtype='f8')
+    highs = np.ascontiguousarray(candles['high'], dtype='f8')
+    lows = np.ascontiguousarray(candles['low'], dtype='f8')
+    take_profits = np.broadcast_to(np.asarray(take_profit if take_profit is not None else np.nan, dtype='f8'), (n,))
+
+    nonzero = np.flatnonzero(signals)
+    changes = np.flatnonzero(signals[1:] != signals[:-1]) + 1
+    required_margin = opens * size * initial_margin_ratio
+
+    fills = []
+    position = np.zeros(n, dtype='i1')
+    entry_price = np.zeros(n, dtype='f8')
+    balance = starting_balance
+    event_indexes = []
+    event_balances = []
+
+    i = warmup_candles
+    while i < n:
+        # Next candle where the signal asks for a position and the margin allows opening it
+        k = int(np.searchsorted(nonzero, i))
+        if k == len(nonzero):
+            break
+        entry = int(nonzero[k])
+        if required_margin[entry] > balance:
+            entry = _first_index(lambda a, b: (signals[a:b] != 0) & (required_margin[a:b] <= balance), entry, n)
+            if entry == n:
+                break
+
+        side = int(signals[entry])
+        price = opens[entry]
+        direction = OrderDirection(side)
+        fills.append((entry, ENTRY, side, price, size, 0.0))
+
+        # The signal change that would close the position at its open
+        k = int(np.searchsorted(changes, entry, side='right'))
+        signal_exit = int(changes[k]) if k < len(changes) else n
+
+        exit_index = signal_exit
+        tp_price = take_profits[entry]
+        if not np.isnan(tp_price):
+            tp_price = price * (1 + tp_price) if side == 1 else price * (1 - tp_price)
+            if side == 1:
+                tp_index = _first_index(lambda a, b: highs[a:b] >= tp_price, entry, signal_exit)
+            else:
+                tp_index = _first_index(lambda a, b: lows[a:b] <= tp_price, entry, signal_exit)
+
+            if tp_index < signal_exit:
+                realized_pnl = _realized_pnl(direction, price, tp_price, size)
+                balance += realized_pnl
+                fills.append((tp_index, TAKE_PROFIT, -side, tp_price, size, realized_pnl))
+                event_indexes.append(tp_index)
+                event_balances.append(balance)
+
+                position[entry:tp_index] = side
+                entry_price[entry:tp_index] = price
+                i = tp_index + 1
+                continue
+
+        position[entry:exit_index] = side
+        entry_price[entry:exit_index] = price
+        if exit_index == n:
+            break
+
+        realized_pnl = _unrealized_pnl(direction, price, opens[exit_index], size)
+        balance += realized_pnl
+        fills.append((exit_index, EXIT, -side, opens[exit_index], size, realized_pnl))
+        event_indexes.append(exit_index)
+        event_balances.append(balance)
+        i = exit_index
+
+    # Balance at the end of every candle, forward filled from the candles that realized pnl
+    balances = np.full(n, float(starting_balance))
+    if event_indexes:
+        last_event = np.searchsorted(np.asarray(event_indexes, dtype='i8'), np.arange(n), side='right') - 1
+        realized = last_event >= 0
+        balances[realized] = np.asarray(event_balances, dtype='f8')[last_event[realized]]
+
+    # Equity is marked at each open with the state carried over from the previous candle
+    carried_balance = np.concatenate(([float(starting_balance)], balances[:-1]))
+    carried_position = np.concatenate(([0], position[:-1]))
+    carried_entry = np.concatenate(([0.0], entry_price[:-1]))
+    unrealized_pnl = np.where(carried_position == 1, size * (opens - carried_entry), np.where(carried_position == -1, size * (carried_entry - opens), 0.0))
+
+    result = VectorizedResult(
+        portfolio=(carried_balance + unrealized_pnl)[warmup_candles:],
+        time_series=opens[warmup_candles:],
+        position=position,
+        entry_price=entry_price,
+        balance=balances,
+        unrealized_pnl=unrealized_pnl,
+        fills=np.array(fills, dtype=FILL_DTYPE),
+    )
+
+    if parity:
+        check_parity(result, candles, signals, take_profit, size, starting_balance, initial_margin_ratio, maintenance_margin_ratio, warmup_candles)
+
+    return result
+
+def run_vectorized_batch(candles: np.ndarray, signals: np.ndarray, take_profit=None, size=1, starting_balance=1000,
+                         initial_margin_ratio: float = 0.1, warmup_candles: int = 0) -> np.ndarray:
+    # Runs P parameter sets of run_vectorized in lockstep. signals is (P, n) or a shared (n,) array, take_profit,
+    # size and starting_balance are scalars or (P,) arrays. Account state lives in (P,) arrays, so every candle costs
+    # a fixed number of array operations however many parameter sets there are.
+    # Returns the (P, n - warmup_candles) portfolio curves, identical to run_vectorized's for each parameter set.
+    n = len(candles)
+    signals = np.asarray(signals)
+    take_profit = np.asarray(take_profit if take_profit is not None else np.nan, dtype='f8')
+    count = max(len(signals) if signals.ndim > 1 else 1, take_profit.size, np.size(size), np.size(starting_balance))
+    
+    # One contiguous row of P signals per candle
+    signals = np.ascontiguousarray(np.broadcast_to(signals, (count, n)).T)
+    take_profits = np.broadcast_to(take_profit, (count,))
+    sizes = np.broadcast_to(np.asarray(size, dtype='f8'), (count,))
+    has_take_profit = ~np.isnan(take_profits)
+    
+    opens = candles['open'].astype('f8')
+    highs = candles['high'].astype('f8')
+    lows = candles['low'].astype('f8')
+    
+    side = np.zeros(count, dtype='i1')
+    entry_price = np.zeros(count)
+    tp_price = np.full(count, np.nan)
+    balance = np.array(np.broadcast_to(np.asarray(starting_balance, dtype='f8'), (count,)))
+    portfolio = np.empty((count, n - warmup_candles))
+    
+    for i in range(warmup_candles, n):
+        price = opens[i]
+        signal = signals[i]
+        longs = side == 1
+        shorts = side == -1
+        
+        unrealized_pnl = np.where(longs, sizes * (price - entry_price), np.where(shorts, sizes * (entry_price - price), 0.0))
+        portfolio[:, i - warmup_candles] = balance + unrealized_pnl
+        
+        exits = (side != 0) & (signal != side)
+        if exits.any():
+            balance[exits] += unrealized_pnl[exits]
+            side[exits] = 0
+        
+        entries = (side == 0) & (signal != 0) & (price * sizes * initial_margin_ratio <= balance)
+        if entries.any():
+            side[entries] = signal[entries]
+            entry_price[entries] = price
+            tp_price[entries] = np.where(signal[entries] == 1, price * (1 + take_profits[entries]), price * (1 - take_profits[entries]))
+        
+        take_profit_longs = (side == 1) & has_take_profit & (highs[i] >= tp_price)
+        take_profit_shorts = (side == -1) & has_take_profit & (lows[i] <= tp_price)
+        if take_profit_longs.any():
+            balance[take_profit_longs] += (tp_price[take_profit_longs] - entry_price[take_profit_longs]) * sizes[take_profit_longs]
+            side[take_profit_longs] = 0
+        if take_profit_shorts.any():
+            balance[take_profit_shorts] += (entry_price[take_profit_shorts] - tp_price[take_profit_shorts]) * sizes[take_profit_shorts]
+            side[take_profit_shorts] = 0
+    
+    return portfolio
+
+def check_parity(result: VectorizedResult, candles: np.ndarray, signals: np.ndarray, take_profit, size, starting_balance,
+                 initial_margin_ratio, maintenance_margin_ratio, warmup_candles):
+    # Replays the same signals through Account/run_simulation and requires the equity curves to match exactly
+    from src.simulation import run_simulation
+
+    # The vectorized engines don't model liquidation, so neither does the replay
+    account = Account("PARITY", starting_balance, initial_margin_ratio, maintenance_margin_ratio, liquidation=False)
+    strategy = SignalStrategy(account, signals, take_profit, size)
+    _, portfolio, _ = run_simulation(strategy, candles, warmup_candles)
+
+    portfolio = np.asarray(portfolio, dtype='f8')
+    mismatches = np.flatnonzero(portfolio != result.portfolio)
+    assert len(mismatches) == 0, f"Vectorized engine diverges from Account at candle {warmup_candles + mismatches[0]}: {result.portfolio[mismatches[0]]} != {portfolio[mismatches[0]]}"
+
+    end_position = int(account.position.direction) if account.position.direction is not None else 0
+    assert end_position == result.position[-1], f"Vectorized engine ends with position {result.position[-1]}, Account with {end_position}"
+    assert account.collateral_manager.balance == result.balance[-1], f"Vectorized engine ends with balance {result.balance[-1]}, Account with {account.collateral_manager.balance}"
+
+'''
+Event driven equivalent of run_vectorized, used by its parity mode.
+'''
+class SignalStrategy(Strategy):
+    def __init__(self, account: Account, signals: np.ndarray, take_profit=None, size: float = 1):
+        super().__init__(account)
+        self.signals = signals
+        self.take_profits = np.broadcast_to(np.asarray(take_profit if take_profit is not None else np.nan, dtype='f8'), (len(signals),))
+        self.size = size
+        self.signal = 0
+
+    def before(self):
+        self.signal = int(self.signals[self.candles.index])
+        direction = self.account.position.direction
+
+        if direction is not None and direction != self.signal:
+            self.account.exit_market(self.current_price)
+            # Refresh free collateral so a reversal on this candle sees the realized pnl
+            self.account.update_pnl(self.current_price)
+
+    def should_long(self) -> bool:
+        return self.account.position.direction is None and self.signal == 1
+
+    def should_short(self) -> bool:
+        return self.account.position.direction is None and self.signal == -1
+
+    def go_long(self) -> BracketOrder:
+        return self._bracket(OrderDirection.LONG)
+
+    def go_short(self) -> BracketOrder:
+        return self._bracket(OrderDirection.SHORT)
+
+    def _bracket(self, direction: OrderDirection) -> BracketOrder:
+        take_profit = self.take_profits[self.candles.index]
+        take_profit_price = None
+        if not np.isnan(take_profit):
+            take_profit_price = self.current_price * (1 + take_profit) if direction == OrderDirection.LONG else self.current_price * (1 - take_profit)
+
+        order = BaseOrder(direction=direction, size=self.size, price=self.current_price)
+        return BracketOrder(order, take_profit_price)
+
+def _realized_pnl(direction: OrderDirection, entry_price: float, exit_price: float, size: float) -> float:
+    # Same expression as Position._calculate_added_order_pnl
+    if direction == OrderDirection.LONG:
+        return (exit_price - entry_price) * size
+    return (entry_price - exit_price) * size
+
+def _unrealized_pnl(direction: OrderDirection, entry_price: float, mark_price: float, size: float) -> float:
+    # Same expression as Position.calculate_unrealized_pnl
+    if direction == OrderDirection.LONG:
+        return size * (mark_price - entry_price)
+    return size * (entry_price - mark_price)
+
+def _first_index(mask, start: int, stop: int) -> int:
+    # First index in [start, stop) where mask(a, b) is True, searching blocks that double in size so
+    # short trades only touch a few candles. Returns stop when there is none.
+    block = 64
+    while start < stop:
+        end = min(start + block, stop)
+        hits = np.flatnonzero(mask(start, end))
+        if len(hits):
+            return start + int(hits[0])
+        start = end
+        block *= 2
+    return stop
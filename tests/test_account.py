@@ -0,0 +1,57 @@
+from src.account import Account
+from src.order import BaseOrder, BracketOrder, OrderDirection, OrderStatus, OrderType
+
+def bracket_account():
+    account = Account("SOLPERP", 1000, 0.1, 0.05)
+    entry = BaseOrder(OrderDirection.LONG, size=1, price=100, order_type=OrderType.MARKET)
+    account.add_market_order(BracketOrder(entry, take_profit_price=110, stop_loss_price=90))
+    take_profit, stop_loss = sorted(account.order_manager.orders.values(), key=lambda order: order.price, reverse=True)
+    return account, take_profit, stop_loss
+
+def test_bracket_legs_triggered_on_the_same_candle_without_open():
+    # Without the open both legs come back triggered, the first to fill cancels the other
+    account, take_profit, stop_loss = bracket_account()
+    account.check_for_filled_orders(85, 115)
+
+    assert not account.order_manager.orders
+    assert account.position.direction is None
+    assert sorted((take_profit.order_status, stop_loss.order_status), key=lambda status: status.name) == [OrderStatus.CANCELED, OrderStatus.FILLED]
+
+def test_bracket_legs_triggered_on_the_same_candle_along_path():
+    # The candle opens nearer its low, so the stop loss is reached first
+    account, take_profit, stop_loss = bracket_account()
+    account.check_for_filled_orders(85, 115, 95, 100)
+
+    assert not account.order_manager.orders
+    assert stop_loss.order_status == OrderStatus.FILLED
+    assert take_profit.order_status == OrderStatus.CANCELED
+
+def long_with_take_profit():
+    # Long 10 at 100 with a take profit at 110, liquidated at about 88.9 while the take profit rests
+    account = Account("SOLPERP", 200, 0.1, 0.05)
+    entry = BaseOrder(OrderDirection.LONG, size=10, price=100, order_type=OrderType.MARKET)
+    account.add_market_order(BracketOrder(entry, take_profit_price=110))
+    return account
+
+def test_liquidation_reached_before_take_profit_on_the_path():
+    account = long_with_take_profit()
+    liquidation_price = account.check_for_filled_orders(85, 112, 95, 100, liquidate=True)
+
+    assert liquidation_price is not None and 85 < liquidation_price < 90
+    assert account.position.direction is None and not account.order_manager.orders
+
+def test_no_liquidation_after_take_profit_closed_the_position():
+    account = long_with_take_profit()
+    liquidation_price = account.check_for_filled_orders(85, 112, 105, 100, liquidate=True)
+
+    assert liquidation_price is None
+    assert account.collateral_manager.balance == 300
+
+def test_liquidation_after_a_single_limit_fill():
+    # Adding to the long at 95 moves the liquidation price above the fill, the account is liquidated where the order filled
+    account = Account("SOLPERP", 200, 0.1, 0.05)
+    account.add_market_order(BracketOrder(BaseOrder(OrderDirection.LONG, size=10, price=100, order_type=OrderType.MARKET)))
+    account.add_limit_order(BaseOrder(OrderDirection.LONG, size=10, price=95), 100)
+    liquidation_price = account.check_for_filled_orders(94.5, 97, 96, 96, liquidate=True)
+
+    assert liquidation_price == 95
@@ -0,0 +1,40 @@
+import math
+import random
+from src.order import BaseOrder, OrderDirection
+from src.order_manager import OrderManager
+
+def test_removing_one_of_two_equal_orders_removes_that_order():
+    order_manager = OrderManager("SOLPERP")
+    first = BaseOrder(OrderDirection.LONG, size=1, price=100)
+    second = BaseOrder(OrderDirection.LONG, size=1, price=100)
+    order_manager.add_order(first)
+    order_manager.add_order(second)
+
+    order_manager.remove_order(second)
+
+    assert list(order_manager.orders) == [first.uid]
+    assert order_manager.get_triggered_orders(99, 101) == [first]
+    assert order_manager.long_orders.level_sizes == {100: 1}
+    assert order_manager.long_orders.total_size == 1 and order_manager.long_orders.total_value == 100
+
+def test_totals_stay_exact_over_many_add_remove_cycles():
+    # The book never empties, so nothing resets the totals along the way
+    rng = random.Random(0)
+    order_manager = OrderManager("SOLPERP")
+    orders = []
+    def add():
+        order = BaseOrder(OrderDirection.LONG, size=rng.uniform(0.001, 10), price=round(rng.uniform(50, 150), 2))
+        order_manager.add_order(order)
+        orders.append(order)
+
+    for _ in range(1000):
+        add()
+    for _ in range(50_000):
+        add()
+        order_manager.remove_order(orders.pop(rng.randrange(len(orders))))
+
+    group = order_manager.long_orders
+    assert group.total_size == math.fsum(order.size for order in orders)
+    assert group.total_value == math.fsum(order.size * order.price for order in orders)
+    for price, size in group.level_sizes.items():
+        assert size == math.fsum(order.size for order in orders if order.price == price)
@@ -0,0 +1,77 @@
+import numpy as np
+from src.account import PortfolioAccount
+from src.candle_manager import CANDLE_DTYPE
+from src.order import BaseOrder, BracketOrder, OrderDirection
+from src.simulation import _window_study, dynamic_optimization, run_portfolio_simulation
+from src.strategy import Strategy, load_strategy_class
+
+MINUTE = 60 * 1000
+
+def flat_candles(starts):
+    candles = np.zeros(len(starts), dtype=CANDLE_DTYPE)
+    candles['start'] = starts
+    candles['open'] = candles['close'] = 100
+    candles['high'] = 101
+    candles['low'] = 99
+    return candles
+
+class HoldTenCandles(Strategy):
+    # Goes long on its first candle and exits on its 11th
+    def __init__(self, account):
+        super().__init__(account)
+        self.seen = 0
+
+    def before(self):
+        self.seen += 1
+
+    def update_position(self):
+        if self.seen == 11:
+            self.account.exit_market(self.current_price)
+
+    def should_long(self):
+        return self.seen == 1
+
+    def go_long(self):
+        return BracketOrder(BaseOrder(OrderDirection.LONG, size=1, price=self.current_price))
+
+def test_portfolio_metrics_use_the_merged_bar_clock():
+    # A is missing bars 20-39, B is listed at bar 50 and only prints every other bar
+    minutes = np.arange(100)
+    starts = {
+        'A': np.concatenate((minutes[:20], minutes[40:])) * MINUTE,
+        'B': minutes[50::2] * MINUTE,
+    }
+    account = PortfolioAccount(list(starts), 10_000, 0.1, 0.05)
+    strategies = {symbol: HoldTenCandles(account[symbol]) for symbol in starts}
+    run_portfolio_simulation(account, strategies, {symbol: flat_candles(s) for symbol, s in starts.items()})
+
+    bars = np.union1d(starts['A'], starts['B'])
+    for symbol, strategy in strategies.items():
+        opened = np.searchsorted(bars, starts[symbol][0])
+        closed = np.searchsorted(bars, starts[symbol][10])
+        fills = strategy.metrics.fills.to_numpy()
+        assert fills['candle_index'].tolist() == [opened, closed]
+
+        performance = strategy.metrics.performance()
+        assert performance['average_trade_duration'] == closed - opened
+        assert performance['exposure'] == (closed - opened) / len(bars)
+
+def test_window_studies_resume_only_with_the_same_settings(tmp_path):
+    # One window of 2 trials, a rerun resumes its study, other settings start a new one
+    candles = flat_candles(np.arange(300) * MINUTE)
+    def optimize(strategy_file='strategies/test_strategy.py', **settings):
+        strategy_class = load_strategy_class(strategy_file)
+        return dynamic_optimization(candles, 2, 200, 250, 100, 50, strategy_class=strategy_class, checkpoint_dir=str(tmp_path), **settings)
+    def journals():
+        return sorted(path.name for path in tmp_path.glob('*.journal'))
+
+    optimize()
+    first = journals()
+    optimize()
+    assert journals() == first
+    assert len(_window_study(str(tmp_path), first[0][:-len('.journal')]).trials) == 2
+
+    optimize(target='sharpe')
+    assert len(journals()) == 2
+    optimize(strategy_file='strategies/test_strategy_2.py')
+    assert len(journals()) == 3